@@ -1,6 +1,7 @@
 import streamlit as st
 
 from modules.utils import set_sidebar
+from modules.warmup import start_warm_up
 
 
 def main():
@@ -10,6 +11,7 @@ def main():
         layout="centered",
     )
     set_sidebar()
+    start_warm_up()
     st.title("SQL Injections via LLMs")
     st.markdown("### *Welcome to Effixis' demo for AMLD EPFL 2024!* 🎉")
 
@@ -0,0 +1,137 @@
+"""
+Measure the model work saved by cancelling superseded submissions.
+
+Usage: python -m benchmarks.cancellation_benchmark [--sessions 50]
+
+Every session submits a question to Level 2 and, before the answer is
+complete, submits another one, like a player clicking Enter again. Both
+submissions run to the end without cancellation, while with it the first one
+is aborted mid-stream. The models answer from the local stub, behind an
+admission controller with tight limits, so wasted calls delay the others.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Optional
+
+import numpy as np
+
+from benchmarks.load_test import load_page
+from benchmarks.openai_stub import start_stub
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--resubmit-after-ms", type=float, default=600.0)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--llm-limits",
+        default="gpt-3.5-turbo=600:600000",
+        help="LLM_LIMITS of the admission controller",
+    )
+    args = parser.parse_args()
+
+    stub = start_stub(first_token_ms=args.first_token_ms, token_ms=args.token_ms)
+    workdir = tempfile.mkdtemp(prefix="cancellation_benchmark_")
+    # Must be set before the app modules are imported
+    os.environ["OPENAI_API_BASE"] = stub.url
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["METRICS_PATH"] = os.path.join(workdir, "metrics.jsonl")
+    os.environ["LLM_LIMITS"] = args.llm_limits
+
+    from modules.admission import admission_controller, admission_session
+    from modules.cancellation import Cancelled, submission, submission_registry
+    from modules.metrics import read_spans
+    from modules.models import load_chat_model
+    from modules.pipeline import run_level
+    from modules.schema import load_sql_query_chain
+    from modules.utils import load_snapshot_pool, load_sql_classifier, query_budget
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("langchain_core.callbacks.manager").setLevel(logging.ERROR)
+
+    page = load_page(2)
+    llm = load_chat_model(page.OPENAI_MODEL)
+    chain = load_sql_query_chain(llm)
+    pool = load_snapshot_pool()
+    classifier = load_sql_classifier()
+
+    def run_submission(
+        session_id: str, attempt: int, cancellation: bool
+    ) -> Optional[float]:
+        snapshot_id = f"{session_id}-{attempt}"
+        scope = (
+            submission(session_id, page.PAGE_TITLE) if cancellation else nullcontext()
+        )
+        start = time.perf_counter()
+        try:
+            with admission_session(session_id), scope:
+                run_level(
+                    page.PAGE_TITLE,
+                    f"Question {attempt} of {session_id}: rename the first artist",
+                    chain,
+                    pool,
+                    snapshot_id,
+                    safeguard_llm=llm,
+                    classifier=classifier,
+                    budget=query_budget(),
+                )
+        except Cancelled:
+            return None
+        finally:
+            pool.release(snapshot_id)
+        return (time.perf_counter() - start) * 1000
+
+    print(
+        f"{args.sessions} sessions resubmitting after {args.resubmit_after_ms:g} ms, "
+        f"limits {args.llm_limits}:"
+    )
+    for cancellation in (False, True):
+        # Fresh rate limits for every run
+        admission_controller.cache_clear()
+        registry = submission_registry()
+        registry.cancelled.clear()
+        first_submissions = ThreadPoolExecutor(args.sessions)
+
+        def run_session(i: int) -> Optional[float]:
+            session_id = f"{'on' if cancellation else 'off'}-{i}"
+            first = first_submissions.submit(
+                run_submission, session_id, 1, cancellation
+            )
+            time.sleep(args.resubmit_after_ms / 1000)
+            second = run_submission(session_id, 2, cancellation)
+            first.result()
+            return second
+
+        since = time.time()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.sessions) as executor:
+            latencies = list(executor.map(run_session, range(args.sessions)))
+        elapsed = time.perf_counter() - start
+        first_submissions.shutdown()
+
+        spans = [
+            record
+            for record in read_spans()
+            if record["ts"] >= since and record["stage"] != "submission"
+        ]
+        completion_tokens = sum(record["completion_tokens"] for record in spans)
+        p50, p95 = np.percentile([ms for ms in latencies if ms is not None], [50, 95])
+        print(
+            f"  cancellation {'on ' if cancellation else 'off'}  "
+            f"{elapsed:6.2f} s  resubmissions p50 {p50:7.0f} ms  p95 {p95:7.0f} ms  "
+            f"model calls {admission_controller().admitted:4}  "
+            f"completion tokens {completion_tokens:5}  "
+            f"cancelled {sum(registry.cancelled.values())}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Run a corpus of injection prompts through the level pipelines.
+
+Usage: python -m benchmarks.evaluate_attacks [corpus.jsonl] [--workers 4] [--stub]
+
+Every line of the corpus is a JSON object with a `prompt` and optionally an
+`id`. Each prompt is run through every level, spread over a pool of worker
+processes. Every worker thread plays on its own Chinook snapshot, reset
+after each successful attack. A prompt bypasses a level when the database
+was altered. Model calls go to the OpenAI API, or to a local stub with
+--stub, and each worker makes at most --concurrency of them at once.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Iterator
+
+from benchmarks.load_test import load_page, safeguard_model
+from benchmarks.openai_stub import DEFAULT_SQL, start_stub
+
+UNLIMITED = "gpt-3.5-turbo=1000000:1000000000,gpt-4=1000000:1000000000"
+
+# Set up once per worker process by _init_worker
+_worker: dict[str, Any] = {}
+
+
+def _init_worker(levels: list[int], workdir: str, concurrency: int) -> None:
+    # Must be set before the app modules are imported
+    os.environ["METRICS_PATH"] = os.path.join(workdir, f"metrics-{os.getpid()}.jsonl")
+
+    from modules.models import load_chat_model
+    from modules.schema import load_sql_query_chain
+    from modules.utils import load_snapshot_pool, load_sql_classifier, query_budget
+
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("langchain_core.callbacks.manager").setLevel(logging.ERROR)
+
+    pages = {level: load_page(level) for level in levels}
+    models = {
+        level: load_chat_model(page.OPENAI_MODEL) for level, page in pages.items()
+    }
+    _worker.update(
+        pages=pages,
+        chains={level: load_sql_query_chain(llm) for level, llm in models.items()},
+        # Level 1 has no safeguard
+        safeguards={
+            level: load_chat_model(safeguard_model(page))
+            for level, page in pages.items()
+            if level > 1
+        },
+        pool=load_snapshot_pool(),
+        classifier=load_sql_classifier(),
+        budget=query_budget(),
+        threads=ThreadPoolExecutor(concurrency),
+        local=threading.local(),
+    )
+
+
+def _evaluate(item: tuple[str, str, int]) -> dict[str, Any]:
+    from modules.admission import Overloaded, admission_session
+    from modules.pipeline import run_level
+
+    prompt_id, prompt, number = item
+    page = _worker["pages"][number]
+    # One snapshot per worker thread, for all the prompts it runs
+    local = _worker["local"]
+    if not hasattr(local, "session_id"):
+        local.session_id = f"worker-{os.getpid()}-{threading.get_ident()}"
+
+    verdict = {"id": prompt_id, "level": number, "prompt": prompt}
+    start = time.perf_counter()
+    try:
+        with admission_session(local.session_id):
+            result = run_level(
+                page.PAGE_TITLE,
+                prompt,
+                _worker["chains"][number],
+                _worker["pool"],
+                local.session_id,
+                safeguard_llm=_worker["safeguards"].get(number),
+                classifier=_worker["classifier"],
+                skip_safeguard_for=frozenset(getattr(page, "SKIP_SAFEGUARD_FOR", ())),
+                budget=_worker["budget"],
+            )
+    except Overloaded as e:
+        return verdict | {"bypassed": None, "error": f"Overloaded: {e}"}
+    except Exception as e:
+        return verdict | {"bypassed": None, "error": repr(e)}
+    bypassed = result.batch is not None and result.batch.modified
+    if bypassed:
+        _worker["pool"].reset(local.session_id)
+    return verdict | {
+        "bypassed": bypassed,
+        "generated_sql": result.generated_sql,
+        "kind": result.kind.value if result.kind is not None else None,
+        "safe_query": result.safe_query,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def _evaluate_chunk(items: list[tuple[str, str, int]]) -> list[dict[str, Any]]:
+    return list(_worker["threads"].map(_evaluate, items))
+
+
+def _read_corpus(path: str) -> list[tuple[str, str]]:
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [
+        (str(entry.get("id", i)), entry["prompt"]) for i, entry in enumerate(entries)
+    ]
+
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", nargs="?", default="benchmarks/attack_corpus.jsonl")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Model calls at once per worker"
+    )
+    parser.add_argument("--stub", action="store_true", help="Answer with a stub")
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="SQL the stub answers")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--llm-limits",
+        help="LLM_LIMITS of the admission controllers, unlimited with --stub",
+    )
+    parser.add_argument(
+        "--output", default="benchmarks/results/attacks", help="Report directory"
+    )
+    args = parser.parse_args()
+
+    if args.stub:
+        stub = start_stub(
+            sql=args.sql, first_token_ms=args.first_token_ms, token_ms=args.token_ms
+        )
+        os.environ["OPENAI_API_BASE"] = stub.url
+        os.environ["OPENAI_API_KEY"] = "stub"
+        if args.llm_limits is None:
+            args.llm_limits = UNLIMITED
+    if args.llm_limits is not None:
+        os.environ["LLM_LIMITS"] = args.llm_limits
+    # The workers share the rate limits of the API key
+    os.environ["APP_REPLICAS"] = str(args.workers)
+
+    corpus = _read_corpus(args.corpus)
+    items = [
+        (prompt_id, prompt, level)
+        for prompt_id, prompt in corpus
+        for level in args.levels
+    ]
+    workdir = tempfile.mkdtemp(prefix="attacks_")
+    os.makedirs(args.output, exist_ok=True)
+    verdicts_path = os.path.join(args.output, "verdicts.jsonl")
+
+    start = time.perf_counter()
+    verdicts = []
+    with ProcessPoolExecutor(
+        args.workers,
+        # Forking would copy the stub's server threads mid-request
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(args.levels, workdir, args.concurrency),
+    ) as executor, open(verdicts_path, "w") as f:
+        chunks = _chunks(items, args.concurrency * 2)
+        for chunk in executor.map(_evaluate_chunk, chunks):
+            for verdict in chunk:
+                f.write(json.dumps(verdict) + "\n")
+            verdicts.extend(chunk)
+            print(f"{len(verdicts)}/{len(items)} runs done", end="\r", flush=True)
+    elapsed = time.perf_counter() - start
+    print()
+
+    levels = {}
+    for level in args.levels:
+        runs = [verdict for verdict in verdicts if verdict["level"] == level]
+        judged = [run for run in runs if run["bypassed"] is not None]
+        bypassed = sum(run["bypassed"] for run in judged)
+        levels[level] = {
+            "runs": len(runs),
+            "errors": len(runs) - len(judged),
+            "bypassed": bypassed,
+            "bypass_rate": round(bypassed / len(judged), 4) if judged else None,
+        }
+    summary = {
+        "ts": time.time(),
+        "config": vars(args),
+        "prompts": len(corpus),
+        "elapsed_seconds": round(elapsed, 3),
+        "runs_per_second": round(len(items) / elapsed, 3),
+        "levels": levels,
+    }
+    with open(os.path.join(args.output, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(
+        f"{len(items)} runs of {len(corpus)} prompts in {elapsed:.1f} s "
+        f"({summary['runs_per_second']} runs/s)"
+    )
+    for level, stats in levels.items():
+        rate = stats["bypass_rate"]
+        print(
+            f"  Level {level}: {stats['bypassed']}/{stats['runs'] - stats['errors']} "
+            f"bypassed ({'n/a' if rate is None else f'{rate:.1%}'}), "
+            f"{stats['errors']} errors"
+        )
+    print(f"Verdicts written to {verdicts_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the original pandas leaderboard pipeline with the ranking index.
+
+Usage: python -m benchmarks.leaderboard_benchmark [--players 100000]
+"""
+
+import argparse
+import random
+import time
+
+import pandas as pd
+
+from modules.leaderboard import LEVELS, RankingIndex
+
+pd.set_option("future.no_silent_downcasting", True)
+
+
+def _random_leaderboard(players: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    return {
+        f"player-{i}": {"email": f"player-{i}@example.com"}
+        | {level: rng.random() < 0.5 for level in LEVELS}
+        for i in range(players)
+    }
+
+
+def _pandas_pipeline(leaderboard: dict) -> pd.DataFrame:
+    """The page's pipeline before the ranking index"""
+    return (
+        pd.DataFrame(leaderboard)
+        .transpose()
+        .rename(
+            columns={
+                "level 0": "Level 1",
+                "level 1": "Level 2",
+                "level 2": "Level 3",
+            },
+        )[["Level 1", "Level 2", "Level 3"]]
+        .fillna(False)
+        .map(lambda x: "✅" if x else "❌")
+        .assign(
+            Score=lambda df: df.apply(
+                lambda x: sum(
+                    [int(passing == "✅") * (i + 1) for i, passing in enumerate(x)]
+                ),
+                axis=1,
+            )
+        )
+        .sort_values(by="Score", ascending=False)
+        .reset_index()
+        .rename(columns={"index": "Name"})
+    )
+
+
+def _timed(function, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+
+    leaderboard = _random_leaderboard(args.players)
+    name = f"player-{args.players // 2}"
+
+    rows = []
+
+    elapsed, data = _timed(_pandas_pipeline, leaderboard)
+    rows.append(("pandas", "full render", elapsed))
+    elapsed, _ = _timed(lambda: data.loc[data["Name"] == name])
+    rows.append(("pandas", "name lookup", elapsed))
+
+    ranking = RankingIndex()
+    elapsed, _ = _timed(ranking.update, leaderboard)
+    rows.append(("index", "initial build", elapsed))
+
+    # One player passes another level, as after a submission
+    updated = dict(leaderboard)
+    updated[name] = updated[name] | {level: True for level in LEVELS}
+    elapsed, _ = _timed(ranking.update, updated)
+    rows.append(("index", "update one player", elapsed))
+    elapsed, _ = _timed(ranking.page, 0, args.page_size)
+    rows.append(("index", "first page", elapsed))
+    elapsed, _ = _timed(
+        ranking.page, args.players // args.page_size // 2, args.page_size
+    )
+    rows.append(("index", "middle page", elapsed))
+    elapsed, _ = _timed(ranking.lookup, name)
+    rows.append(("index", "name lookup", elapsed))
+
+    print(f"{args.players:,} players")
+    print(pd.DataFrame(rows, columns=["Pipeline", "Operation", "ms"]).round(3))
+
+
+if __name__ == "__main__":
+    main()
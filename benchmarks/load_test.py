@@ -0,0 +1,234 @@
+"""
+Drive concurrent headless sessions through the level pipelines.
+
+Usage: python -m benchmarks.load_test [--sessions 300] [--concurrency 300]
+
+The level pages are loaded as they are, with their models pointed at a local
+OpenAI-compatible stub, and every session runs the pipeline of one level on
+its own database snapshot, resetting it when it was altered. Throughput and
+latency percentiles per level and stage are printed and written to a JSON
+file, so runs can be compared over time.
+"""
+
+import argparse
+import glob
+import importlib.util
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Optional
+
+import numpy as np
+
+from benchmarks.openai_stub import DEFAULT_SQL, start_stub
+
+
+def load_page(level: int) -> ModuleType:
+    """Import a level page as a module, without running its main"""
+    (path,) = glob.glob(f"pages/Level_{level}:*.py")
+    spec = importlib.util.spec_from_file_location(f"level_{level}_page", path)
+    page = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(page)
+    return page
+
+
+def safeguard_model(page: ModuleType) -> str:
+    """Model of the LLM Safeguard of a level page, its main model by default"""
+    return getattr(page, "OPENAI_MODEL_SAFEGUARD", page.OPENAI_MODEL)
+
+
+def _percentiles(durations: list[float]) -> dict[str, float]:
+    p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+    return {
+        "count": len(durations),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=300)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--sql", default=DEFAULT_SQL, help="SQL the stub answers")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--llm-limits",
+        default="gpt-3.5-turbo=1000000:1000000000,gpt-4=1000000:1000000000",
+        help="LLM_LIMITS of the admission controller, unlimited by default",
+    )
+    parser.add_argument(
+        "--speculation",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Execute the generated SQL while the safeguard runs",
+    )
+    parser.add_argument(
+        "--result-cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Answer read-only statements from the shared result cache",
+    )
+    parser.add_argument(
+        "--leaderboard-db",
+        help="SQLite leaderboard where sessions altering the database submit a key",
+    )
+    parser.add_argument(
+        "--start-file",
+        help="Wait for this file to exist before starting, to start replicas at once",
+    )
+    parser.add_argument(
+        "--output", default="benchmarks/results/load_test.json", help="JSON report"
+    )
+    args = parser.parse_args()
+
+    stub = start_stub(
+        sql=args.sql, first_token_ms=args.first_token_ms, token_ms=args.token_ms
+    )
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    # Must be set before the app modules are imported
+    os.environ["OPENAI_API_BASE"] = stub.url
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["METRICS_PATH"] = os.path.join(workdir, "metrics.jsonl")
+    os.environ["LLM_LIMITS"] = args.llm_limits
+
+    from modules.admission import Overloaded, admission_controller, admission_session
+    from modules.leaderboard import SQLiteBackend
+    from modules.metrics import read_spans, span
+    from modules.models import load_chat_model
+    from modules.pipeline import run_level
+    from modules.schema import load_sql_query_chain
+    from modules.utils import (
+        load_result_cache,
+        load_snapshot_pool,
+        load_sql_classifier,
+        query_budget,
+    )
+
+    # Streamlit warns about the missing runtime and langchain about every
+    # safeguard stream stopped early, neither is relevant here
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    logging.getLogger("langchain_core.callbacks.manager").setLevel(logging.ERROR)
+
+    # Streamlit only caches resources inside a running app, so the chains
+    # are built once here, like the cached ones of the pages
+    pages = {level: load_page(level) for level in args.levels}
+    models = {
+        level: load_chat_model(page.OPENAI_MODEL) for level, page in pages.items()
+    }
+    chains = {level: load_sql_query_chain(llm) for level, llm in models.items()}
+    # Level 1 has no safeguard
+    safeguards = {
+        level: load_chat_model(safeguard_model(page))
+        for level, page in pages.items()
+        if level > 1
+    }
+    pool = load_snapshot_pool()
+    classifier = load_sql_classifier()
+    result_cache = load_result_cache() if args.result_cache else None
+    leaderboard = (
+        SQLiteBackend(args.leaderboard_db) if args.leaderboard_db is not None else None
+    )
+
+    def run_session(i: int) -> Optional[float]:
+        number = args.levels[i % len(args.levels)]
+        page = pages[number]
+        level = page.PAGE_TITLE
+        session_id = f"load-test-{i}"
+        start = time.perf_counter()
+        try:
+            with admission_session(session_id):
+                result = run_level(
+                    level,
+                    # Distinct questions, so no layer can serve a previous answer
+                    f"Question {i}: rename the first artist",
+                    chains[number],
+                    pool,
+                    session_id,
+                    safeguard_llm=safeguards.get(number),
+                    classifier=classifier,
+                    skip_safeguard_for=frozenset(
+                        getattr(page, "SKIP_SAFEGUARD_FOR", ())
+                    ),
+                    budget=query_budget(),
+                    speculate=args.speculation,
+                    result_cache=result_cache,
+                )
+        except Overloaded:
+            pool.release(session_id)
+            return None
+        if result.batch is not None and result.batch.modified:
+            if leaderboard is not None:
+                with span("leaderboard_submit", level):
+                    leaderboard.submit(
+                        f"{session_id}-{os.getpid()}", "load@test", number - 1
+                    )
+            with span("reset", level):
+                pool.reset(session_id)
+        pool.release(session_id)
+        return (time.perf_counter() - start) * 1000
+
+    if args.start_file is not None:
+        print("Ready", flush=True)
+        while not os.path.exists(args.start_file):
+            time.sleep(0.01)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        durations = list(executor.map(run_session, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    sessions = [duration for duration in durations if duration is not None]
+    controller = admission_controller()
+
+    stages: dict[str, dict[str, list[float]]] = {}
+    for record in read_spans():
+        stages.setdefault(record["level"], {}).setdefault(record["stage"], []).append(
+            record["duration_ms"]
+        )
+    report = {
+        "ts": time.time(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_sessions_per_second": round(len(sessions) / elapsed, 3),
+        "shed_sessions": len(durations) - len(sessions),
+        "admitted_model_calls": controller.admitted,
+        "result_cache_hits": result_cache.hits if result_cache else 0,
+        "model_connections": stub.connections,
+        "sessions": _percentiles(sessions),
+        "stages": {
+            level: {stage: _percentiles(durations) for stage, durations in by.items()}
+            for level, by in stages.items()
+        },
+    }
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(
+        f"{len(sessions)} sessions in {elapsed:.2f} s, {report['shed_sessions']} shed "
+        f"({report['throughput_sessions_per_second']} sessions/s), "
+        f"p50 {report['sessions']['p50_ms']} ms, p99 {report['sessions']['p99_ms']} ms, "
+        f"{stub.connections} model connections"
+    )
+    for level, by in report["stages"].items():
+        print(level)
+        for stage, summary in by.items():
+            print(
+                f"  {stage:<20} n={summary['count']:<5} "
+                f"p50={summary['p50_ms']:>9} ms  p99={summary['p99_ms']:>9} ms"
+            )
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Local OpenAI-compatible chat completions server returning canned SQL.
+
+Usage: python -m benchmarks.openai_stub [--port 8765] [--sql "SELECT 1;"]
+Then point the app at it with OPENAI_API_BASE=http://127.0.0.1:8765/v1.
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SQL = "UPDATE Artist SET Name = 'Stub' WHERE ArtistId = 1;"
+# Like real models, text follows the SQL block, so the safeguard stream is
+# stopped early instead of ending on its own
+SAFEGUARD_ANSWER = """The query was checked for malicious code.
+
+SQL query without malicious code:
+'''
+{sql}
+'''
+
+The SQL query above can be executed safely on the database.
+"""
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a whole workshop connecting at once
+    request_queue_size = 1024
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        sql: str = DEFAULT_SQL,
+        first_token_ms: float = 300.0,
+        token_ms: float = 20.0,
+    ) -> None:
+        super().__init__(address, _StubHandler)
+        self.sql = sql
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        # Connections accepted so far, and the ones still open
+        self.connections = 0
+        self.open_connections = 0
+        self._connections_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def process_request(self, request, client_address) -> None:
+        with self._connections_lock:
+            self.connections += 1
+            self.open_connections += 1
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request) -> None:
+        super().shutdown_request(request)
+        with self._connections_lock:
+            self.open_connections -= 1
+
+    def handle_error(self, request, client_address) -> None:
+        # Clients closing their keep-alive connections are expected
+        pass
+
+    def answer(self, prompt: str) -> str:
+        if "malicious SQL code" in prompt:
+            return SAFEGUARD_ANSWER.format(sql=self.sql)
+        return self.sql
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Like real servers, so small chunks on reused connections are not delayed
+    disable_nagle_algorithm = True
+    server: StubServer
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "\n".join(str(message["content"]) for message in body["messages"])
+        # Whitespace-separated words stand in for tokens
+        tokens = [word + " " for word in self.server.answer(prompt).split(" ")]
+        time.sleep(self.server.first_token_ms / 1000)
+        try:
+            if body.get("stream"):
+                self._stream(body["model"], tokens)
+            else:
+                self._complete(body["model"], tokens, prompt)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, e.g. once the safeguard block was closed
+            pass
+
+    def _stream(self, model: str, tokens: list[str]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            self._send_event({"content": token}, model, None)
+            time.sleep(self.server.token_ms / 1000)
+        self._send_event({}, model, "stop")
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def _send_event(self, delta: dict, model: str, finish_reason) -> None:
+        event = {
+            "id": "stub",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self._send_chunk(f"data: {json.dumps(event)}\n\n".encode())
+
+    def _send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _complete(self, model: str, tokens: list[str], prompt: str) -> None:
+        time.sleep(self.server.token_ms * len(tokens) / 1000)
+        completion = {
+            "id": "stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(tokens),
+                "total_tokens": len(prompt) // 4 + len(tokens),
+            },
+        }
+        data = json.dumps(completion).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stub(port: int = 0, **kwargs) -> StubServer:
+    """Serve the stub from a background thread, on a free port by default"""
+    server = StubServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--sql", default=DEFAULT_SQL)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    server = StubServer(
+        ("127.0.0.1", args.port),
+        sql=args.sql,
+        first_token_ms=args.first_token_ms,
+        token_ms=args.token_ms,
+    )
+    print(f"Serving canned completions on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
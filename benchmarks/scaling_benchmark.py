@@ -0,0 +1,128 @@
+"""
+Measure how the throughput grows with the number of app replicas.
+
+Usage: python -m benchmarks.scaling_benchmark [--replicas 1 2 4] [--sessions 100]
+
+Every replica is a load test process with its own database snapshots and
+its own stub, standing in for the OpenAI API which scales independently.
+All replicas submit to one shared SQLite leaderboard, like the replicas of
+the "scaled" compose profile. Each replica gets the same load, so with
+linear scaling the throughput grows with the replicas at a flat latency.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _run_replicas(replicas: int, args: argparse.Namespace) -> dict:
+    workdir = tempfile.mkdtemp(prefix="scaling_")
+    start_file = os.path.join(workdir, "start")
+    processes = []
+    for i in range(replicas):
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.load_test",
+            "--sessions",
+            str(args.sessions),
+            "--concurrency",
+            str(args.concurrency),
+            "--first-token-ms",
+            str(args.first_token_ms),
+            "--token-ms",
+            str(args.token_ms),
+            "--leaderboard-db",
+            os.path.join(workdir, "leaderboard.db"),
+            "--start-file",
+            start_file,
+            "--output",
+            os.path.join(workdir, f"replica-{i}.json"),
+        ]
+        with open(os.path.join(workdir, f"replica-{i}.log"), "w") as log:
+            processes.append(
+                subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=log,
+                    text=True,
+                    env=os.environ | {"APP_REPLICAS": str(replicas)},
+                )
+            )
+    # Replicas start together once all of them are set up
+    for process in processes:
+        for line in process.stdout:
+            if line.strip() == "Ready":
+                break
+    open(start_file, "w").close()
+    for process in processes:
+        process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"A replica failed, see the logs in {workdir}")
+
+    reports = []
+    for i in range(replicas):
+        with open(os.path.join(workdir, f"replica-{i}.json")) as f:
+            reports.append(json.load(f))
+    sessions = sum(report["sessions"]["count"] for report in reports)
+    elapsed = max(report["elapsed_seconds"] for report in reports)
+    return {
+        "replicas": replicas,
+        "sessions": sessions,
+        "shed_sessions": sum(report["shed_sessions"] for report in reports),
+        "elapsed_seconds": elapsed,
+        "throughput_sessions_per_second": round(sessions / elapsed, 3),
+        "p50_ms": max(report["sessions"]["p50_ms"] for report in reports),
+        "p99_ms": max(report["sessions"]["p99_ms"] for report in reports),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=100, help="Per replica")
+    parser.add_argument("--concurrency", type=int, default=50, help="Per replica")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0)
+    parser.add_argument(
+        "--output", default="benchmarks/results/scaling.json", help="JSON report"
+    )
+    args = parser.parse_args()
+
+    runs = [_run_replicas(replicas, args) for replicas in args.replicas]
+    baseline = runs[0]["throughput_sessions_per_second"] / runs[0]["replicas"]
+    for run in runs:
+        run["efficiency"] = round(
+            run["throughput_sessions_per_second"] / (baseline * run["replicas"]), 3
+        )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "ts": time.time(),
+                "cpus": os.cpu_count(),
+                "config": vars(args),
+                "runs": runs,
+            },
+            f,
+            indent=2,
+        )
+
+    print(
+        f"{'replicas':>8} {'sessions/s':>11} {'efficiency':>10} {'p50':>9} {'p99':>9}"
+    )
+    for run in runs:
+        print(
+            f"{run['replicas']:>8} {run['throughput_sessions_per_second']:>11.2f} "
+            f"{run['efficiency']:>10.0%} {run['p50_ms']:>7.0f}ms {run['p99_ms']:>7.0f}ms"
+        )
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
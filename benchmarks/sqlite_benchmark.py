@@ -0,0 +1,113 @@
+"""
+Compare SELECT latencies on the Chinook database across engine setups.
+
+Usage: python -m benchmarks.sqlite_benchmark [--repeat 50]
+
+"from_uri" is how the app used to query a working copy of the database,
+through `SQLDatabase.from_uri` with the default pooling and pragmas. The
+other setups are the pooled golden engine and the in-memory session
+snapshots, with the default pragmas of SQLite and with the app profile.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Callable
+
+from langchain_community.utilities import SQLDatabase
+
+from modules.executor import execute_batch
+from modules.snapshots import SnapshotPool
+from modules.sqlite_profile import SQLiteProfile, create_golden_engine
+from modules.utils import BACKUP_DB
+
+QUERIES = {
+    "point lookup": "SELECT * FROM Track WHERE TrackId = 1234",
+    "join + group by": """
+        SELECT g.Name, count(*), sum(il.UnitPrice * il.Quantity) AS revenue
+        FROM InvoiceLine il JOIN Track t USING (TrackId) JOIN Genre g USING (GenreId)
+        GROUP BY g.Name ORDER BY revenue DESC
+    """,
+    "self-join sort": """
+        SELECT a.Name, b.Name FROM Track a JOIN Track b ON a.AlbumId = b.AlbumId
+        ORDER BY a.Milliseconds + b.Milliseconds DESC LIMIT 10
+    """,
+    "distinct": "SELECT DISTINCT Composer, Milliseconds / 1000 FROM Track ORDER BY 1, 2",
+    # Its temporary b-tree outgrows the default cache of SQLite
+    "large distinct": """
+        SELECT count(*) FROM (
+            SELECT DISTINCT a.Name, b.GenreId FROM Track a JOIN Track b ON b.TrackId < 200
+        )
+    """,
+}
+# What SQLite does without any pragma
+SQLITE_DEFAULTS = SQLiteProfile(
+    cache_size_kib=2000,
+    mmap_size_bytes=0,
+    temp_store="DEFAULT",
+    journal_mode="DELETE",
+    synchronous="FULL",
+)
+
+
+def _medians_ms(
+    setups: dict[str, Callable[[str], object]], sql: str, repeat: int
+) -> list[float]:
+    # Setups take turns, so a noisy moment does not favour one of them
+    durations: dict[str, list[float]] = {name: [] for name in setups}
+    for _ in range(repeat):
+        for name, run in setups.items():
+            start = time.perf_counter()
+            run(sql)
+            durations[name].append((time.perf_counter() - start) * 1000)
+    return [statistics.median(durations[name]) for name in setups]
+
+
+def _from_uri(path: str) -> Callable[[str], object]:
+    database = SQLDatabase.from_uri(f"sqlite:///{path}")
+    return database.run
+
+
+def _engine(profile: SQLiteProfile) -> Callable[[str], object]:
+    engine = create_golden_engine(BACKUP_DB, profile, pool_size=8)
+
+    def run(sql: str) -> object:
+        with engine.connect() as connection:
+            return connection.exec_driver_sql(sql).fetchall()
+
+    return run
+
+
+def _snapshot(profile: SQLiteProfile) -> Callable[[str], object]:
+    snapshot = SnapshotPool(BACKUP_DB, spares=1).acquire("bench")
+    profile.apply(snapshot.connection, in_memory=True)
+    return lambda sql: execute_batch(snapshot, [sql])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    working_db = os.path.join(tempfile.mkdtemp(prefix="sqlite_"), "chinook.db")
+    shutil.copy(BACKUP_DB, working_db)
+    setups = {
+        "from_uri": _from_uri(working_db),
+        "engine, defaults": _engine(SQLITE_DEFAULTS),
+        "engine, profile": _engine(SQLiteProfile()),
+        "snapshot, defaults": _snapshot(SQLITE_DEFAULTS),
+        "snapshot, profile": _snapshot(SQLiteProfile()),
+    }
+
+    print(f"Median SELECT latency in ms over {args.repeat} runs:")
+    print(f"  {'':<20}" + "".join(f"{name:>20}" for name in setups))
+    for query, sql in QUERIES.items():
+        medians = _medians_ms(setups, sql, args.repeat)
+        print(f"  {query:<20}" + "".join(f"{median:>20.3f}" for median in medians))
+
+
+if __name__ == "__main__":
+    main()
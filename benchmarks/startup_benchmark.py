@@ -0,0 +1,77 @@
+"""
+Measure the cold import time of each page and the warm-up steps.
+
+Usage: python -m benchmarks.startup_benchmark [--repeat 5]
+
+Every measurement runs in a fresh interpreter, as after a restart.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules imported by each page, streamlit itself is the baseline
+PAGES = {
+    "streamlit": ["streamlit"],
+    "Introduction": ["streamlit", "modules.utils", "modules.warmup"],
+    "The Leaderboard": ["streamlit", "modules.utils", "modules.leaderboard"],
+    "Admin Metrics": ["streamlit", "modules.utils", "modules.metrics"],
+    "Level 3": [
+        "streamlit",
+        "modules.utils",
+        "modules.llm_cache",
+        "modules.metrics",
+        "modules.models",
+        "modules.schema",
+        "modules.safeguard",
+        "modules.sql_classifier",
+        "modules.streaming",
+    ],
+}
+
+IMPORT_SCRIPT = """
+import importlib, json, time
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+print(json.dumps((time.perf_counter() - start) * 1000))
+"""
+
+WARM_UP_SCRIPT = """
+import contextlib, io, json, logging
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+from modules.warmup import warm_up
+with contextlib.redirect_stdout(io.StringIO()):
+    timings = warm_up()
+print(json.dumps(timings))
+"""
+
+
+def _run(script: str) -> object:
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"Cold imports, median of {args.repeat} runs:")
+    for page, modules in PAGES.items():
+        runs = [_run(IMPORT_SCRIPT.format(modules=modules)) for _ in range(args.repeat)]
+        print(f"  {page:<16} {statistics.median(runs):>8.0f} ms")
+
+    print(f"Warm-up steps, median of {args.repeat} runs:")
+    runs = [_run(WARM_UP_SCRIPT) for _ in range(args.repeat)]
+    for step in runs[0]:
+        median = statistics.median(run[step] for run in runs)
+        print(f"  {step:<16} {median:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from langchain_openai.chat_models.base import _convert_delta_to_message_chunk
+
+from modules.cancellation import check_cancelled
+from modules.metrics import count_tokens
+
+# Tokens reserved for the completion when the model sets no max_tokens
+COMPLETION_TOKENS_ESTIMATE = 256
+# Longest wait between two cancellation checks of a queued call
+CHECK_INTERVAL_SECONDS = 0.25
+
+
+@dataclass
+class ModelLimits:
+    requests_per_minute: int
+    tokens_per_minute: int
+
+
+# OpenAI usage tier 1 limits, override them with LLM_LIMITS
+MODEL_LIMITS = {
+    "gpt-3.5-turbo": ModelLimits(3_500, 60_000),
+    "gpt-4": ModelLimits(500, 10_000),
+}
+DEFAULT_LIMITS = ModelLimits(500, 10_000)
+
+
+class Overloaded(Exception):
+    """Raised when a model call is shed instead of being queued"""
+
+
+class TokenBucket:
+    """Rate limiter refilled continuously up to `burst_seconds` worth of rate"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 6.0) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken, 0 if it can be taken now"""
+        self._refill()
+        # Larger amounts than the bucket holds go through once it is full
+        missing = min(amount, self.capacity) - self.level
+        return max(missing, 0.0) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass(eq=False)
+class _Ticket:
+    session_id: str
+    tokens: int
+    granted: bool = False
+
+
+class _ModelQueue:
+    def __init__(self, limits: ModelLimits) -> None:
+        self.requests = TokenBucket(limits.requests_per_minute)
+        self.tokens = TokenBucket(limits.tokens_per_minute)
+        # Sessions in round-robin order, each with its waiting calls
+        self.sessions: OrderedDict[str, deque[_Ticket]] = OrderedDict()
+
+    def position(self, ticket: _Ticket) -> int:
+        """1-based rank of the ticket in the round-robin order"""
+        rounds = self.sessions[ticket.session_id].index(ticket)
+        position = 0
+        for i in range(rounds + 1):
+            for calls in self.sessions.values():
+                if len(calls) > i:
+                    position += 1
+                    if calls[i] is ticket:
+                        return position
+        return position
+
+
+class AdmissionController:
+    """
+    Process-wide gate in front of every model call.
+
+    Calls wait in one queue per model until both its requests and tokens per
+    minute buckets allow them, so bursts are smoothed out below the provider
+    rate limits instead of being answered with 429 errors. Sessions are
+    served round-robin, so a session sending many calls cannot starve the
+    others. Past `max_queue` waiting calls or `max_wait` seconds of waiting,
+    calls are shed with `Overloaded`. Waiting calls whose `check` raises,
+    e.g. because the player left, give up their place in the queue.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[dict[str, ModelLimits]] = None,
+        default_limits: ModelLimits = DEFAULT_LIMITS,
+        max_queue: int = 300,
+        max_wait: float = 60.0,
+    ) -> None:
+        self.limits = MODEL_LIMITS if limits is None else limits
+        self.default_limits = default_limits
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.admitted = 0
+        self.shed = 0
+        self.cancelled = 0
+        self._condition = threading.Condition()
+        self._queues: dict[str, _ModelQueue] = {}
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def _queue(self, model: str) -> _ModelQueue:
+        if model not in self._queues:
+            self._queues[model] = _ModelQueue(
+                self.limits.get(model, self.default_limits)
+            )
+        return self._queues[model]
+
+    def _dispatch(self, queue: _ModelQueue) -> float:
+        """Admit the calls the buckets allow, return the time until the next one"""
+        while queue.sessions:
+            session_id, calls = next(iter(queue.sessions.items()))
+            ticket = calls[0]
+            wait = max(
+                queue.requests.wait_time(1), queue.tokens.wait_time(ticket.tokens)
+            )
+            if wait > 0:
+                return wait
+            queue.requests.take(1)
+            queue.tokens.take(ticket.tokens)
+            ticket.granted = True
+            calls.popleft()
+            if calls:
+                queue.sessions.move_to_end(session_id)
+            else:
+                del queue.sessions[session_id]
+            self._waiting -= 1
+            self.admitted += 1
+            self._condition.notify_all()
+        return self.max_wait
+
+    def _remove(self, queue: _ModelQueue, ticket: _Ticket) -> None:
+        calls = queue.sessions[ticket.session_id]
+        calls.remove(ticket)
+        if not calls:
+            del queue.sessions[ticket.session_id]
+        self._waiting -= 1
+        self._condition.notify_all()
+
+    def acquire(
+        self,
+        model: str,
+        session_id: str,
+        tokens: int,
+        on_position: Optional[Callable[[int], None]] = None,
+        check: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Block until the call may be sent, reporting its queue position.
+
+        `check` is called while waiting and aborts the wait by raising.
+        """
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            if self._waiting >= self.max_queue:
+                self.shed += 1
+                raise Overloaded(f"{self._waiting} model calls are already waiting")
+            queue = self._queue(model)
+            ticket = _Ticket(session_id, tokens)
+            queue.sessions.setdefault(session_id, deque()).append(ticket)
+            self._waiting += 1
+
+        shown = None
+        while True:
+            with self._condition:
+                wait = self._dispatch(queue)
+                if ticket.granted:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._remove(queue, ticket)
+                    self.shed += 1
+                    raise Overloaded(f"Waited more than {self.max_wait:g} s")
+                position = queue.position(ticket)
+                if on_position is None or position == shown:
+                    if check is not None:
+                        wait = min(wait, CHECK_INTERVAL_SECONDS)
+                    self._condition.wait(min(wait, remaining))
+                    if check is None:
+                        continue
+            try:
+                # Checking and rendering happen outside the lock
+                if check is not None:
+                    check()
+                if on_position is not None and position != shown:
+                    on_position(position)
+                    shown = position
+            except BaseException:
+                # Also a page stopped by Streamlit while rendering the position
+                with self._condition:
+                    if ticket.granted:
+                        # Admitted meanwhile, but the call will not be sent
+                        queue.requests.refund(1)
+                        queue.tokens.refund(ticket.tokens)
+                    else:
+                        self._remove(queue, ticket)
+                    self.cancelled += 1
+                    self._condition.notify_all()
+                raise
+        if on_position is not None and shown is not None:
+            on_position(0)
+
+    def settle(self, model: str, reserved: int, used: int) -> None:
+        """Give back the tokens reserved for a call but not used by it"""
+        with self._condition:
+            self._queue(model).tokens.refund(reserved - used)
+            self._condition.notify_all()
+
+
+def _parse_limits(spec: str) -> dict[str, ModelLimits]:
+    """Parse limits written as `model=requests:tokens,model=requests:tokens`"""
+    limits = {}
+    for item in filter(None, spec.split(",")):
+        model, values = item.strip().split("=")
+        requests, tokens = values.split(":")
+        limits[model] = ModelLimits(int(requests), int(tokens))
+    return limits
+
+
+def _replica_share(limits: ModelLimits, replicas: int) -> ModelLimits:
+    return ModelLimits(
+        max(limits.requests_per_minute // replicas, 1),
+        max(limits.tokens_per_minute // replicas, 1),
+    )
+
+
+@lru_cache(maxsize=None)
+def admission_controller() -> AdmissionController:
+    """
+    Controller shared by all pages and sessions of the process.
+
+    The replicas of a scaled deployment share the API key, so each one only
+    admits its APP_REPLICAS share of the limits.
+    """
+    replicas = int(os.environ.get("APP_REPLICAS", 1))
+    limits = MODEL_LIMITS | _parse_limits(os.environ.get("LLM_LIMITS", ""))
+    return AdmissionController(
+        limits={
+            model: _replica_share(model_limits, replicas)
+            for model, model_limits in limits.items()
+        },
+        default_limits=_replica_share(DEFAULT_LIMITS, replicas),
+        max_queue=int(os.environ.get("LLM_MAX_QUEUE", 300)),
+        max_wait=float(os.environ.get("LLM_MAX_WAIT_SECONDS", 60.0)),
+    )
+
+
+_session_var: ContextVar[tuple[str, Optional[Callable[[int], None]]]] = ContextVar(
+    "admission_session", default=("anonymous", None)
+)
+
+
+@contextmanager
+def admission_session(
+    session_id: str, on_position: Optional[Callable[[int], None]] = None
+) -> Iterator[None]:
+    """Attribute the model calls made inside to a session for fair queuing"""
+    token = _session_var.set((session_id, on_position))
+    try:
+        yield
+    finally:
+        _session_var.reset(token)
+
+
+class AdmittedChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose calls to the API go through the admission controller"""
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        # langchain only passes the run manager, which streams the tokens to
+        # the callbacks, to signatures naming it
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Only reached on LLM cache misses, so cached answers are never queued
+        check_cancelled()
+        controller = admission_controller()
+        session_id, on_position = _session_var.get()
+        prompt_tokens = sum(
+            count_tokens(str(message.content), self.model_name) for message in messages
+        )
+        reserved = prompt_tokens + (self.max_tokens or COMPLETION_TOKENS_ESTIMATE)
+        controller.acquire(
+            self.model_name, session_id, reserved, on_position, check_cancelled
+        )
+        # Calls stopped early keep their whole reservation
+        used = reserved
+        try:
+            result = super()._generate(messages, stop, run_manager, **kwargs)
+            usage = (result.llm_output or {}).get("token_usage") or {}
+            used = usage.get("total_tokens") or prompt_tokens + sum(
+                count_tokens(generation.text, self.model_name)
+                for generation in result.generations
+            )
+            return result
+        finally:
+            controller.settle(self.model_name, reserved, used)
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """
+        Like ChatOpenAI._stream, closing the response however the stream ends.
+
+        Callbacks stop streams early by raising from `on_llm_new_token`. The
+        half-read response was then only closed by the garbage collector,
+        possibly inside the shared connection pool while it holds its lock,
+        which hung every later model call of the process.
+        """
+        message_dicts, params = self._create_message_dicts(messages, stop)
+        response = self.client.create(
+            messages=message_dicts, **{**params, **kwargs, "stream": True}
+        )
+        try:
+            default_chunk_class = AIMessageChunk
+            for chunk in response:
+                if not isinstance(chunk, dict):
+                    chunk = chunk.model_dump()
+                if len(chunk["choices"]) == 0:
+                    continue
+                choice = chunk["choices"][0]
+                message = _convert_delta_to_message_chunk(
+                    choice["delta"], default_chunk_class
+                )
+                default_chunk_class = message.__class__
+                generation_info = {}
+                if finish_reason := choice.get("finish_reason"):
+                    generation_info["finish_reason"] = finish_reason
+                logprobs = choice.get("logprobs")
+                if logprobs:
+                    generation_info["logprobs"] = logprobs
+                generation = ChatGenerationChunk(
+                    message=message, generation_info=generation_info or None
+                )
+                if run_manager:
+                    run_manager.on_llm_new_token(
+                        generation.text, chunk=generation, logprobs=logprobs
+                    )
+                yield generation
+        finally:
+            response.close()
@@ -0,0 +1,138 @@
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+
+from modules.metrics import span
+
+# Reasons a submission is cancelled for
+SUPERSEDED = "superseded"
+ABANDONED = "abandoned"
+
+
+class Cancelled(Exception):
+    """Raised inside a submission once it was superseded or abandoned"""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Submission:
+    """
+    Model calls and stages run for one click on Enter of a session.
+
+    `probe` returns the reason to cancel the submission, or None. It is
+    polled by `check`, so conditions only the caller can observe, like a
+    pending rerun of the page, cancel the submission too.
+    """
+
+    def __init__(
+        self, session_id: str, probe: Optional[Callable[[], Optional[str]]] = None
+    ) -> None:
+        self.session_id = session_id
+        self.submission_id = uuid.uuid4().hex
+        self.probe = probe
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str) -> None:
+        if self.reason is None:
+            self.reason = reason
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.probe is not None:
+            reason = self.probe()
+            if reason is not None:
+                self.cancel(reason)
+        return self.reason is not None
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise Cancelled(self.reason)
+
+
+class SubmissionRegistry:
+    """Latest submission of every session, and counts of the cancelled ones"""
+
+    def __init__(self) -> None:
+        self.cancelled: Counter[str] = Counter()
+        self._lock = threading.Lock()
+        self._active: dict[str, Submission] = {}
+
+    def start(
+        self, session_id: str, probe: Optional[Callable[[], Optional[str]]] = None
+    ) -> Submission:
+        """Register a new submission, superseding the running one of the session"""
+        submission = Submission(session_id, probe)
+        with self._lock:
+            previous = self._active.get(session_id)
+            self._active[session_id] = submission
+        if previous is not None:
+            previous.cancel(SUPERSEDED)
+        return submission
+
+    def finish(self, submission: Submission) -> None:
+        with self._lock:
+            if self._active.get(submission.session_id) is submission:
+                del self._active[submission.session_id]
+
+    def count(self, reason: str) -> None:
+        """Count a submission aborted for `reason`"""
+        with self._lock:
+            self.cancelled[reason] += 1
+
+
+@lru_cache(maxsize=None)
+def submission_registry() -> SubmissionRegistry:
+    """Registry shared by all pages and sessions of the process"""
+    return SubmissionRegistry()
+
+
+_submission_var: ContextVar[Optional[Submission]] = ContextVar(
+    "submission", default=None
+)
+
+
+def check_cancelled() -> None:
+    """Raise Cancelled if the submission of the caller was cancelled"""
+    submission = _submission_var.get()
+    if submission is not None:
+        submission.check()
+
+
+@contextmanager
+def submission(
+    session_id: str,
+    level: str,
+    probe: Optional[Callable[[], Optional[str]]] = None,
+) -> Iterator[Submission]:
+    """
+    Run the stages inside as one cancellable submission of the session.
+
+    Starting another submission of the same session cancels this one. The
+    model calls inside check for cancellation while they wait to be admitted
+    and on every streamed token, so a cancelled submission raises Cancelled
+    instead of paying for output nobody will see. The whole submission is
+    recorded as a span, with the reason it was cancelled for if it was.
+    """
+    registry = submission_registry()
+    current = registry.start(session_id, probe)
+    token = _submission_var.set(current)
+    try:
+        with span("submission", level, submission_id=current.submission_id) as record:
+            try:
+                yield current
+            except BaseException:
+                # Cleanups on the way out, like rendering in a page stopped by
+                # Streamlit, may have replaced Cancelled with their exception
+                if current.reason is not None:
+                    record["cancelled"] = current.reason
+                    registry.count(current.reason)
+                raise
+    finally:
+        _submission_var.reset(token)
+        registry.finish(current)
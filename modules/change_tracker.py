@@ -0,0 +1,166 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Authorizer actions that alter the schema of the database they target
+_SCHEMA_ACTIONS = {
+    sqlite3.SQLITE_ALTER_TABLE,
+    sqlite3.SQLITE_CREATE_INDEX,
+    sqlite3.SQLITE_CREATE_TABLE,
+    sqlite3.SQLITE_CREATE_TRIGGER,
+    sqlite3.SQLITE_CREATE_VIEW,
+    sqlite3.SQLITE_CREATE_VTABLE,
+    sqlite3.SQLITE_DROP_INDEX,
+    sqlite3.SQLITE_DROP_TABLE,
+    sqlite3.SQLITE_DROP_TRIGGER,
+    sqlite3.SQLITE_DROP_VIEW,
+    sqlite3.SQLITE_DROP_VTABLE,
+}
+# Authorizer actions that alter rows of the table they target
+_ROW_ACTIONS = {sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE}
+# Pragmas that rewrite the database header when given a value
+_HEADER_PRAGMAS = {"application_id", "schema_version", "user_version"}
+# Authorizer actions refused on sandboxed connections, other databases may be
+# files on disk, and COMMIT or ROLLBACK would end the transaction of the executor
+_SANDBOX_ACTIONS = {sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH}
+# Header fields, schema_version is incremented by every schema change
+_HEADER_QUERY = (
+    "SELECT * FROM pragma_schema_version, pragma_user_version, pragma_application_id"
+)
+
+# Must stay above the sqlite3 statement cache size (128 by default), see below
+_MAX_CLASSIFIED_STATEMENTS = 512
+
+
+class ChangeTracker:
+    """
+    Detects writes to the main database of a SQLite engine in constant time.
+
+    An authorizer classifies every statement when SQLite prepares it. The
+    connection's `total_changes` counter tells whether a row write actually
+    touched any row, and the header fields, read from memory around schema
+    statements, whether a schema write actually changed the schema, as
+    `CREATE TABLE IF NOT EXISTS` may not. The verdict is recorded once the
+    statement succeeded, so checking it afterwards costs no query.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._modified = False
+        self._settings_changed = False
+        self._sandboxed = False
+        self._denied = False
+
+    @property
+    def modified(self) -> bool:
+        return self._modified
+
+    @property
+    def settings_changed(self) -> bool:
+        """
+        Whether a statement changed a setting of the connection, like a pragma.
+
+        Such changes are not writes to the database, but rollbacks keep them.
+        """
+        return self._settings_changed
+
+    @property
+    def denied(self) -> bool:
+        """Whether a statement was refused by the sandbox"""
+        return self._denied
+
+    def sandbox(self) -> None:
+        """
+        Refuse statements that could outlive the transaction they run in.
+
+        Attaching a database, which may create a file on disk, and ending the
+        transaction are denied. VACUUM, including VACUUM INTO a file, is
+        refused by SQLite itself as long as the transaction is open.
+        """
+        self._sandboxed = True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._modified = False
+            self._settings_changed = False
+            self._denied = False
+
+    def attach(self, engine: Engine) -> None:
+        """Start tracking the connections opened by the engine from now on"""
+        event.listen(engine, "connect", self._on_connect)
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def _on_connect(self, dbapi_connection: sqlite3.Connection, record) -> None:
+        record.info["statement_writes"] = OrderedDict()
+        record.info["current_writes"] = None
+
+        def authorize(action, arg1, arg2, db_name, _trigger):
+            writes = record.info["current_writes"]
+            if writes is None:
+                return sqlite3.SQLITE_OK
+            if self._sandboxed and (
+                action in _SANDBOX_ACTIONS
+                # The executor begins its transaction through here too
+                or (action == sqlite3.SQLITE_TRANSACTION and arg1 != "BEGIN")
+            ):
+                self._denied = True
+                return sqlite3.SQLITE_DENY
+            if action in _SCHEMA_ACTIONS and db_name == "main":
+                writes.add("schema")
+            elif action in _ROW_ACTIONS and db_name == "main":
+                writes.add("rows")
+            elif action == sqlite3.SQLITE_PRAGMA and arg2 is not None:
+                if arg1.lower() in _HEADER_PRAGMAS:
+                    writes.add("schema")
+                else:
+                    writes.add("settings")
+            elif action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+                writes.add("settings")
+            return sqlite3.SQLITE_OK
+
+        dbapi_connection.set_authorizer(authorize)
+
+    def _before_cursor_execute(self, conn, cursor, statement, *_) -> None:
+        # The authorizer only runs when SQLite prepares a statement, and the
+        # sqlite3 module reuses prepared statements from its LRU cache, so the
+        # classification is remembered per statement text
+        classified = conn.info["statement_writes"]
+        writes = classified.get(statement)
+        if writes is None or "schema" in writes:
+            # Before its first run the statement is not classified yet
+            conn.info["current_writes"] = None
+            conn.info["header"] = cursor.connection.execute(_HEADER_QUERY).fetchone()
+        if writes is None:
+            writes = classified[statement] = set()
+        classified.move_to_end(statement)
+        if len(classified) > _MAX_CLASSIFIED_STATEMENTS:
+            classified.popitem(last=False)
+        conn.info["current_writes"] = writes
+        conn.info["total_changes"] = cursor.connection.total_changes
+
+    def _after_cursor_execute(self, conn, cursor, *_) -> None:
+        writes = conn.info["current_writes"]
+        conn.info["current_writes"] = None
+        if (
+            "schema" in writes
+            and cursor.connection.execute(_HEADER_QUERY).fetchone()
+            != conn.info["header"]
+        ) or (
+            "rows" in writes
+            and cursor.connection.total_changes != conn.info["total_changes"]
+        ):
+            with self._lock:
+                self._modified = True
+        if "settings" in writes:
+            with self._lock:
+                self._settings_changed = True
+
+    def _handle_error(self, context) -> None:
+        # Failing statements never reach after_cursor_execute
+        if context.connection is not None:
+            context.connection.info["current_writes"] = None
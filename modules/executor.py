@@ -0,0 +1,167 @@
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Optional
+
+from sqlalchemy import Connection
+from sqlalchemy.exc import DBAPIError
+
+from modules.snapshots import Snapshot
+
+if TYPE_CHECKING:
+    from modules.result_cache import ResultCache
+
+# Number of virtual machine instructions between two budget checks
+PROGRESS_STEPS = 1000
+FETCH_SIZE = 100
+
+
+@dataclass
+class QueryBudget:
+    """Limits applied to every statement of a batch"""
+
+    timeout_seconds: float = 2.0
+    max_vm_steps: int = 50_000_000
+    max_rows: int = 1000
+
+
+@dataclass
+class StatementResult:
+    statement: str
+    columns: list[str] = field(default_factory=list)
+    rows: list[tuple] = field(default_factory=list)
+    error: Optional[str] = None
+    # Set when the statement was interrupted for exceeding its budget
+    aborted: bool = False
+    # Set when rows beyond the row budget were not fetched
+    truncated: bool = False
+    duration_ms: float = 0.0
+    # Set when the result was served by the result cache
+    cached: bool = False
+
+
+@dataclass
+class BatchResult:
+    results: list[StatementResult]
+    modified: bool
+    duration_ms: float
+
+
+class _BudgetGuard:
+    """Progress handler interrupting statements that exceed their budget"""
+
+    def __init__(self, budget: QueryBudget) -> None:
+        self.budget = budget
+        self.start()
+
+    def start(self) -> None:
+        self.deadline = time.monotonic() + self.budget.timeout_seconds
+        self.steps = 0
+        self.exceeded: Optional[str] = None
+
+    def __call__(self) -> int:
+        self.steps += PROGRESS_STEPS
+        if self.steps > self.budget.max_vm_steps:
+            self.exceeded = f"{self.budget.max_vm_steps:,} VM steps"
+        elif time.monotonic() > self.deadline:
+            self.exceeded = f"{self.budget.timeout_seconds:g} s"
+        return self.exceeded is not None
+
+
+def _run_statement(
+    connection: Connection, statement: str, guard: _BudgetGuard, max_rows: int
+) -> StatementResult:
+    result = StatementResult(statement)
+    start = time.perf_counter()
+    guard.start()
+    try:
+        cursor = connection.exec_driver_sql(statement)
+        if cursor.returns_rows:
+            result.columns = list(cursor.keys())
+            _fetch_rows(cursor, result, max_rows)
+    except DBAPIError as e:
+        if guard.exceeded is not None:
+            result.aborted = True
+            result.error = (
+                f"Query aborted after exceeding its budget of {guard.exceeded}."
+            )
+        else:
+            result.error = str(e.orig)
+    result.duration_ms = (time.perf_counter() - start) * 1000
+    return result
+
+
+def execute_batch(
+    snapshot: Snapshot,
+    statements: list[str],
+    budget: Optional[QueryBudget] = None,
+    cache: Optional["ResultCache"] = None,
+) -> BatchResult:
+    """
+    Run statements on the snapshot connection inside a single transaction.
+
+    Each statement gets its own time and VM step budget, enforced by the
+    SQLite progress handler, and rows are fetched in chunks up to the row
+    budget. Failing or aborted statements are reported and the following
+    ones still run. The change tracker is read once at the end, and the
+    transaction is always rolled back, so the snapshot is back to its
+    previous state for free. If any statement ended the transaction, or
+    changed settings of the connection that the rollback keeps, like
+    `PRAGMA case_sensitive_like`, the snapshot is marked dirty and will be
+    restored from the golden database on reset.
+
+    With a cache, read-only statements are answered from it while the
+    snapshot is known to hold the golden state, and SQLite is only opened
+    for the statements it cannot answer.
+    """
+    budget = budget or QueryBudget()
+    guard = _BudgetGuard(budget)
+    snapshot.tracker.reset()
+    results = []
+    start = time.perf_counter()
+    use_cache = cache is not None and not snapshot.dirty
+    with ExitStack() as stack:
+        connection = None
+        ended = False
+        for statement in statements:
+            key = cache.key(statement, budget.max_rows) if use_cache else None
+            if key is None:
+                # The statement may write, the following ones see other data
+                use_cache = False
+            else:
+                cached = cache.get(key, statement)
+                if cached is not None:
+                    results.append(cached)
+                    continue
+            if connection is None:
+                connection = stack.enter_context(snapshot.engine.connect())
+                transaction = connection.begin()
+                snapshot.connection.set_progress_handler(guard, PROGRESS_STEPS)
+                stack.callback(snapshot.connection.set_progress_handler, None, 0)
+            result = _run_statement(connection, statement, guard, budget.max_rows)
+            if key is not None:
+                cache.put(key, result)
+            results.append(result)
+            if not snapshot.connection.in_transaction:
+                # What ran before stays, even if a later statement begins again
+                ended = True
+        if connection is not None:
+            if ended or snapshot.tracker.settings_changed:
+                # Cached results no longer match what the snapshot answers
+                snapshot.dirty = True
+            transaction.rollback()
+    return BatchResult(
+        results=results,
+        modified=snapshot.tracker.modified,
+        duration_ms=(time.perf_counter() - start) * 1000,
+    )
+
+
+def _fetch_rows(cursor, result: StatementResult, max_rows: int) -> None:
+    while len(result.rows) < max_rows:
+        rows = cursor.fetchmany(min(FETCH_SIZE, max_rows - len(result.rows)))
+        if not rows:
+            return
+        result.rows.extend(tuple(row) for row in rows)
+    result.truncated = cursor.fetchone() is not None
+    cursor.close()
@@ -0,0 +1,384 @@
+import bisect
+import copy
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Optional, Protocol
+
+import httpx
+import numpy as np
+
+from modules.sqlite_profile import SQLiteProfile
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PANTRY_URL = "https://getpantry.cloud/apiv1/pantry/{pantry_id}/basket/{basket}"
+LEVELS = ["level 0", "level 1", "level 2"]
+LEVEL_COLUMNS = ["Level 1", "Level 2", "Level 3"]
+# Passing level i is worth i + 1 points
+LEVEL_WEIGHTS = np.arange(1, len(LEVELS) + 1)
+
+
+class LeaderboardError(Exception):
+    pass
+
+
+class DisplayNameTaken(LeaderboardError):
+    pass
+
+
+class LeaderboardBackend(Protocol):
+    def fetch(self, etag: Optional[str]) -> tuple[Optional[dict], Optional[str]]:
+        """Return the leaderboard and its ETag, or None if `etag` is current"""
+
+    def submit(self, display_name: str, email: str, level: int) -> None:
+        """Mark the level as passed for the player, creating them if needed"""
+
+
+def _merge_submission(
+    leaderboard: dict, display_name: str, email: str, level: int
+) -> dict:
+    player = leaderboard.get(display_name)
+    if player is not None and player["email"] != email:
+        raise DisplayNameTaken(display_name)
+    player = {"email": email} | {name: False for name in LEVELS} | (player or {})
+    player[LEVELS[level]] = True
+    return leaderboard | {display_name: player}
+
+
+class PantryBackend:
+    """Leaderboard stored as a single JSON basket on getpantry.cloud"""
+
+    def __init__(
+        self,
+        pantry_id: str,
+        basket: str,
+        timeout: float = 10.0,
+        client: Optional[httpx.Client] = None,
+    ) -> None:
+        self.url = PANTRY_URL.format(pantry_id=pantry_id, basket=basket)
+        self.timeout = timeout
+        self._client = client or httpx.Client()
+
+    def fetch(self, etag: Optional[str]) -> tuple[Optional[dict], Optional[str]]:
+        headers = {"If-None-Match": etag} if etag else {}
+        try:
+            response = self._client.get(self.url, headers=headers, timeout=self.timeout)
+        except httpx.HTTPError as e:
+            raise LeaderboardError(str(e)) from e
+        if response.status_code == 304:
+            return None, etag
+        if response.status_code != 200:
+            raise LeaderboardError(f"Pantry returned {response.status_code}")
+        return response.json(), response.headers.get("ETag")
+
+    def submit(self, display_name: str, email: str, level: int) -> None:
+        # Pantry only stores whole documents, so this is a read-modify-write
+        leaderboard, _ = self.fetch(None)
+        self.save(_merge_submission(leaderboard, display_name, email, level))
+
+    def save(self, leaderboard: dict) -> None:
+        try:
+            response = self._client.post(
+                self.url, json=leaderboard, timeout=self.timeout
+            )
+        except httpx.HTTPError as e:
+            raise LeaderboardError(str(e)) from e
+        if response.status_code != 200:
+            raise LeaderboardError(f"Pantry returned {response.status_code}")
+
+
+class InMemoryBackend:
+    """Local stand-in for the Pantry basket, for tests and offline use"""
+
+    def __init__(self, leaderboard: Optional[dict] = None) -> None:
+        self._leaderboard = copy.deepcopy(leaderboard or {})
+        self._version = 0
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def fetch(self, etag: Optional[str]) -> tuple[Optional[dict], Optional[str]]:
+        with self._lock:
+            self.fetches += 1
+            current = str(self._version)
+            if etag == current:
+                return None, etag
+            return copy.deepcopy(self._leaderboard), current
+
+    def submit(self, display_name: str, email: str, level: int) -> None:
+        with self._lock:
+            self._leaderboard = _merge_submission(
+                self._leaderboard, display_name, email, level
+            )
+            self._version += 1
+
+
+class SQLiteBackend:
+    """
+    Leaderboard stored in an embedded SQLite database, one row per player.
+
+    Submissions are single indexed upserts, so their cost does not depend on
+    the number of players and concurrent submitters cannot overwrite each
+    other. The score is a generated column computed by SQLite. If a Pantry
+    backend is given, the whole leaderboard is pushed to it in one request
+    per `sync_interval` whenever it changed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sync_to: Optional[PantryBackend] = None,
+        sync_interval: float = 30.0,
+        profile: SQLiteProfile = SQLiteProfile(),
+    ) -> None:
+        self.path = path
+        self.profile = profile
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leaderboard (
+                    display_name TEXT PRIMARY KEY,
+                    email TEXT NOT NULL,
+                    level_0 INTEGER NOT NULL DEFAULT 0,
+                    level_1 INTEGER NOT NULL DEFAULT 0,
+                    level_2 INTEGER NOT NULL DEFAULT 0,
+                    score INTEGER GENERATED ALWAYS AS
+                        (level_0 + 2 * level_1 + 3 * level_2) STORED,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS leaderboard_score"
+                " ON leaderboard (score DESC)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS leaderboard_updated_at"
+                " ON leaderboard (updated_at)"
+            )
+        self._synced_version: Optional[str] = None
+        if sync_to is not None:
+            threading.Thread(
+                target=self._sync, args=(sync_to, sync_interval), daemon=True
+            ).start()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Connection committed if the block succeeds, and closed after it"""
+        connection = sqlite3.connect(self.path, timeout=10.0)
+        try:
+            self.profile.apply(connection)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _version(self, connection: sqlite3.Connection) -> str:
+        count, updated_at = connection.execute(
+            "SELECT count(*), max(updated_at) FROM leaderboard"
+        ).fetchone()
+        return f"{count}-{updated_at}"
+
+    def fetch(self, etag: Optional[str]) -> tuple[Optional[dict], Optional[str]]:
+        with self._connect() as connection:
+            version = self._version(connection)
+            if etag == version:
+                return None, etag
+            rows = connection.execute(
+                "SELECT display_name, email, level_0, level_1, level_2"
+                " FROM leaderboard ORDER BY score DESC"
+            ).fetchall()
+        return {
+            name: {"email": email} | dict(zip(LEVELS, map(bool, levels)))
+            for name, email, *levels in rows
+        }, version
+
+    def submit(self, display_name: str, email: str, level: int) -> None:
+        column = f"level_{int(level)}"
+        try:
+            with self._connect() as connection:
+                cursor = connection.execute(
+                    f"""
+                    INSERT INTO leaderboard (display_name, email, {column}, updated_at)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT (display_name) DO UPDATE
+                    SET {column} = 1, updated_at = excluded.updated_at
+                    WHERE email = excluded.email
+                    """,
+                    (display_name, email, time.time()),
+                )
+        except sqlite3.Error as e:
+            raise LeaderboardError(str(e)) from e
+        if cursor.rowcount == 0:
+            raise DisplayNameTaken(display_name)
+
+    def _sync(self, pantry: PantryBackend, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                leaderboard, version = self.fetch(self._synced_version)
+                if leaderboard is not None:
+                    pantry.save(leaderboard)
+                    self._synced_version = version
+            except LeaderboardError as e:
+                print(e)
+
+
+def score_levels(passed: np.ndarray) -> np.ndarray:
+    """Weighted sum of the passed levels, for a (players, levels) boolean array"""
+    return passed.astype(np.int64) @ LEVEL_WEIGHTS
+
+
+def _passed_levels(leaderboard: dict, names: list[str]) -> np.ndarray:
+    return np.array(
+        [[bool(leaderboard[name].get(level)) for level in LEVELS] for name in names],
+        dtype=bool,
+    ).reshape(len(names), len(LEVELS))
+
+
+class RankingIndex:
+    """
+    Players kept sorted by descending score, then name.
+
+    Updating from a new leaderboard only re-scores and re-inserts the players
+    whose levels changed. Pages are sliced from the sorted keys and players
+    are looked up by name through a dict.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._passed: dict[str, tuple[bool, ...]] = {}
+        self._scores: dict[str, int] = {}
+        self._order: list[tuple[int, str]] = []
+        self._players: dict[str, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def update(self, leaderboard: dict) -> None:
+        with self._lock:
+            if not self._order:
+                names = list(leaderboard)
+                passed = _passed_levels(leaderboard, names)
+                scores = score_levels(passed)
+                order = np.lexsort((np.array(names, dtype=object), -scores))
+                self._order = [(-int(scores[i]), names[i]) for i in order]
+                self._passed = dict(zip(names, map(tuple, passed.tolist())))
+                self._scores = dict(zip(names, scores.tolist()))
+                self._players = dict(leaderboard)
+                return
+
+            # Player dicts are compared as a whole, which is cheap for unchanged ones
+            changed = [
+                name
+                for name, player in leaderboard.items()
+                if self._players.get(name) != player
+            ]
+            removed = self._players.keys() - leaderboard.keys()
+            passed = _passed_levels(leaderboard, changed)
+            scores = score_levels(passed).tolist()
+            for name in removed:
+                self._remove(name)
+            for name, levels, score in zip(changed, passed.tolist(), scores):
+                if name in self._passed:
+                    self._remove(name)
+                self._passed[name] = tuple(levels)
+                self._scores[name] = score
+                bisect.insort(self._order, (-score, name))
+            self._players = dict(leaderboard)
+
+    def _remove(self, name: str) -> None:
+        key = (-self._scores.pop(name), name)
+        del self._order[bisect.bisect_left(self._order, key)]
+        del self._passed[name]
+        del self._players[name]
+
+    def page(self, number: int, size: int) -> "pd.DataFrame":
+        """Rows of the 0-based page, formatted for display"""
+        # pandas is only needed once the leaderboard is shown
+        import pandas as pd
+
+        with self._lock:
+            keys = self._order[number * size : (number + 1) * size]
+            passed = np.array([self._passed[name] for _, name in keys], dtype=bool)
+        passed = passed.reshape(len(keys), len(LEVELS))
+        frame = pd.DataFrame(
+            np.where(passed, "✅", "❌"),
+            columns=LEVEL_COLUMNS,
+            index=pd.RangeIndex(number * size, number * size + len(keys)),
+        )
+        frame.insert(0, "Name", [name for _, name in keys])
+        frame["Score"] = [-score for score, _ in keys]
+        return frame
+
+    def lookup(self, name: str) -> Optional[tuple[bool, ...]]:
+        """Levels passed by the player, or None if they are not on the board"""
+        return self._passed.get(name)
+
+
+class CachedLeaderboard:
+    """
+    Shared read cache in front of a leaderboard backend.
+
+    Reads within `ttl` seconds of the last fetch are served from memory. Once
+    stale, the cached copy is still returned while a single background
+    thread revalidates it with a conditional request, so the backend sees at
+    most one fetch per interval however many viewers there are.
+    """
+
+    def __init__(self, backend: LeaderboardBackend, ttl: float = 5.0) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self._leaderboard: Optional[dict] = None
+        self._ranking = RankingIndex()
+        self._etag: Optional[str] = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+
+    def get(self) -> RankingIndex:
+        with self._lock:
+            leaderboard = self._leaderboard
+            stale = time.monotonic() - self._fetched_at > self.ttl
+            refresh = stale and leaderboard is not None and not self._refreshing
+            if refresh:
+                self._refreshing = True
+        if leaderboard is None:
+            with self._fetch_lock:
+                # Another viewer may have fetched it while we were waiting
+                if self._leaderboard is None:
+                    self._refresh()
+        elif refresh:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self._ranking
+
+    def submit(self, display_name: str, email: str, level: int) -> None:
+        self.backend.submit(display_name, email, level)
+        with self._lock:
+            # Revalidate on the next read so the player soon sees their score
+            self._fetched_at = 0.0
+
+    def _refresh(self) -> None:
+        with self._lock:
+            etag = self._etag
+        leaderboard, etag = self.backend.fetch(etag)
+        if leaderboard is not None:
+            self._ranking.update(leaderboard)
+        with self._lock:
+            if leaderboard is not None:
+                self._leaderboard = leaderboard
+                self._etag = etag
+            self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self._refresh()
+        except LeaderboardError as e:
+            # Keep serving the stale copy until the backend recovers
+            print(e)
+        finally:
+            with self._lock:
+                self._refreshing = False
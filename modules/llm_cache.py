@@ -0,0 +1,150 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+import streamlit as st
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.globals import get_llm_cache, set_llm_cache
+from langchain_core.language_models import BaseChatModel
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration
+
+from modules.schema import golden_version
+from modules.sqlite_profile import SQLiteProfile, sqlite_profile
+
+LLM_CACHE_DB = "data/llm_cache.db"
+
+
+def _normalize(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Persistent cache of model responses stored in a local SQLite file.
+
+    Entries are keyed by the model parameters, the whitespace-normalized
+    prompt and the schema version. Entries older than `ttl` seconds are
+    ignored, and the least recently used ones are evicted past `max_entries`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        schema_version: Callable[[], str],
+        max_entries: int = 10_000,
+        ttl: float = 24 * 60 * 60,
+        profile: SQLiteProfile = SQLiteProfile(),
+    ) -> None:
+        self.schema_version = schema_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The replicas of a scaled deployment share the file, the WAL journal
+        # of the profile lets them read while one of them writes
+        self._connection = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        profile.apply(self._connection)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                generations TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at"
+            " ON llm_cache (accessed_at)"
+        )
+        self._connection.commit()
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        key = "\0".join([llm_string, _normalize(prompt), self.schema_version()])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT generations FROM llm_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._connection.commit()
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?)",
+                (key, dumps(list(return_val)), now, now),
+            )
+            self._connection.execute(
+                "DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl,)
+            )
+            self._connection.execute(
+                """
+                DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._connection.commit()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM llm_cache")
+            self._connection.commit()
+
+
+@st.cache_resource(show_spinner=False)
+def enable_llm_cache() -> SQLiteLLMCache:
+    """Route all model calls of the process through the persistent cache"""
+    cache = SQLiteLLMCache(
+        os.environ.get("LLM_CACHE_PATH", LLM_CACHE_DB),
+        schema_version=golden_version,
+        max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10_000)),
+        ttl=float(os.environ.get("LLM_CACHE_TTL_SECONDS", 24 * 60 * 60)),
+        profile=sqlite_profile(),
+    )
+    set_llm_cache(cache)
+    return cache
+
+
+def cache_stopped_response(
+    llm: BaseChatModel, messages: list[BaseMessage], text: str
+) -> None:
+    """
+    Cache the text of a stream stopped early as the response to `messages`.
+
+    langchain only caches completions that ran to the end, so the safeguard
+    answers, whose stream is stopped once the SQL block is closed, were never
+    cached. The entry is stored under the key langchain looks up.
+    """
+    cache = get_llm_cache()
+    if cache is None or llm.cache is False:
+        return
+    cache.update(
+        dumps(messages),
+        llm._get_llm_string(),
+        [ChatGeneration(message=AIMessage(content=text))],
+    )
@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+from typing import Any, Iterator, Optional
+
+import tiktoken
+from langchain_community.callbacks.openai_info import (
+    get_openai_token_cost_for_model,
+)
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+METRICS_LOG = os.environ.get("METRICS_PATH", "data/metrics.jsonl")
+METRICS_BACKUPS = 5
+
+
+@lru_cache
+def _get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding files could not be downloaded
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text))
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    Count the tokens and estimated cost of the model calls made during a span.
+
+    Streamed completions carry no usage report, so prompt tokens are counted
+    with tiktoken and every streamed chunk is counted as one token. Usage
+    reported by the API takes precedence when present.
+    """
+
+    def __init__(self) -> None:
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self._runs: dict[Any, dict[str, Any]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        params = kwargs.get("invocation_params", {})
+        model = params.get("model_name") or params.get("model") or "gpt-3.5-turbo"
+        prompt_tokens = sum(
+            count_tokens(str(message.content), model)
+            for batch in messages
+            for message in batch
+        )
+        self._runs[run_id] = {"model": model, "prompt": prompt_tokens, "streamed": 0}
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs) -> None:
+        if run_id in self._runs:
+            self._runs[run_id]["streamed"] += 1
+
+    def on_llm_end(self, response: LLMResult, *, run_id, **kwargs) -> None:
+        self._finish(run_id, (response.llm_output or {}).get("token_usage") or {})
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        # Aborted streams were still billed for what they produced
+        self._finish(run_id, {})
+
+    def _finish(self, run_id, usage: dict[str, int]) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        prompt_tokens = usage.get("prompt_tokens", run["prompt"])
+        completion_tokens = usage.get("completion_tokens", run["streamed"])
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        try:
+            self.cost_usd += get_openai_token_cost_for_model(
+                run["model"], prompt_tokens
+            ) + get_openai_token_cost_for_model(
+                run["model"], completion_tokens, is_completion=True
+            )
+        except ValueError:
+            pass
+
+
+_usage_callback_var: ContextVar[Optional[UsageCallbackHandler]] = ContextVar(
+    "usage_callback", default=None
+)
+register_configure_hook(_usage_callback_var, True)
+
+
+_logger_lock = threading.Lock()
+
+
+def _get_logger() -> logging.Logger:
+    logger = logging.getLogger("metrics")
+    with _logger_lock:
+        if logger.handlers:
+            return logger
+        os.makedirs(os.path.dirname(METRICS_LOG) or ".", exist_ok=True)
+        handler = RotatingFileHandler(
+            METRICS_LOG, maxBytes=10 * 1024 * 1024, backupCount=METRICS_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+@contextmanager
+def span(stage: str, level: str, **fields: Any) -> Iterator[dict[str, Any]]:
+    """
+    Time a pipeline stage and append it to the rotating JSONL metrics log.
+
+    Model calls made inside the span are counted automatically. The yielded
+    record can be updated with extra fields before it is written.
+    """
+    usage = UsageCallbackHandler()
+    token = _usage_callback_var.set(usage)
+    record = {"ts": time.time(), "level": level, "stage": stage, **fields}
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _usage_callback_var.reset(token)
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        record["prompt_tokens"] = usage.prompt_tokens
+        record["completion_tokens"] = usage.completion_tokens
+        record["cost_usd"] = usage.cost_usd
+        _get_logger().info(json.dumps(record))
+
+
+def read_spans() -> list[dict[str, Any]]:
+    """All spans still kept in the metrics log and its rotated backups"""
+    paths = [f"{METRICS_LOG}.{i}" for i in range(METRICS_BACKUPS, 0, -1)]
+    spans = []
+    for path in [*paths, METRICS_LOG]:
+        if os.path.exists(path):
+            with open(path) as f:
+                spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
@@ -0,0 +1,73 @@
+import os
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+import streamlit as st
+
+if TYPE_CHECKING:
+    import httpx
+    import openai
+
+    from modules.admission import AdmittedChatOpenAI
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+@lru_cache
+def load_http_client() -> "httpx.Client":
+    """
+    Keep-alive connection pool shared by every model call of the process.
+
+    Consecutive calls, like the SQL generation and the safeguard of a level,
+    reuse open connections instead of each paying a TCP and TLS handshake.
+    With HTTP/2, concurrent calls are multiplexed over the same connection.
+    """
+    import httpx
+
+    return httpx.Client(
+        http2=os.environ.get("LLM_HTTP2", "1") == "1" and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 300)),
+            max_keepalive_connections=int(os.environ.get("LLM_MAX_KEEPALIVE", 50)),
+            keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_SECONDS", 120.0)),
+        ),
+    )
+
+
+@lru_cache
+def load_openai_clients() -> tuple["openai.OpenAI", "openai.AsyncOpenAI"]:
+    """OpenAI clients shared by all models, the sync one on the shared pool"""
+    import openai
+
+    # Same environment variable as ChatOpenAI, the stub relies on it
+    base_url = os.environ.get("OPENAI_API_BASE")
+    return (
+        openai.OpenAI(base_url=base_url, http_client=load_http_client()),
+        openai.AsyncOpenAI(base_url=base_url),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def load_chat_model(model: str) -> "AdmittedChatOpenAI":
+    """
+    Streaming chat model shared by all pages and sessions.
+
+    Models are built once per model instead of on every rerun of the page
+    scripts, and all of them send their requests through the shared clients.
+    """
+    from modules.admission import AdmittedChatOpenAI
+
+    client, async_client = load_openai_clients()
+    return AdmittedChatOpenAI(
+        model=model,
+        temperature=0,
+        streaming=True,
+        client=client.chat.completions,
+        async_client=async_client.chat.completions,
+    )
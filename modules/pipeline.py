@@ -0,0 +1,112 @@
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Callable, ContextManager, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable
+
+from modules.executor import BatchResult, QueryBudget, execute_batch
+from modules.metrics import span
+from modules.result_cache import ResultCache
+from modules.safeguard import run_safeguard, safe_statements
+from modules.snapshots import SnapshotPool
+from modules.speculation import SpeculativeExecution
+from modules.sql_classifier import SQLClassifier, StatementKind, split_statements
+from modules.streaming import collect_stream
+
+
+@dataclass
+class LevelResult:
+    generated_sql: str
+    kind: Optional[StatementKind] = None
+    safe_query: Optional[str] = None
+    # None when the safeguard did not return any SQL query
+    batch: Optional[BatchResult] = None
+
+
+@dataclass
+class LevelHooks:
+    """
+    Rendering hooks of `run_level`, the defaults render nothing.
+
+    `stage` returns the context a stage runs in, entered around its span.
+    `stream` runs the model calls, with the arguments of `collect_stream`.
+    """
+
+    stage: Callable[[str], ContextManager[None]] = lambda stage: nullcontext()
+    stream: Callable[..., str] = collect_stream
+    safeguard_skipped: Callable[[StatementKind], None] = lambda kind: None
+
+
+def run_level(
+    level: str,
+    question: str,
+    chain: Runnable,
+    pool: SnapshotPool,
+    session_id: str,
+    safeguard_llm: Optional[BaseChatModel] = None,
+    classifier: Optional[SQLClassifier] = None,
+    skip_safeguard_for: frozenset[StatementKind] = frozenset(),
+    budget: Optional[QueryBudget] = None,
+    speculate: bool = False,
+    result_cache: Optional[ResultCache] = None,
+    hooks: Optional[LevelHooks] = None,
+) -> LevelResult:
+    """
+    Run the pipeline of a level page, rendering through `hooks` if given.
+
+    `chain` is the SQL generation chain of the level. Every stage is recorded
+    as a span named after it. Without `safeguard_llm` the generated SQL is
+    executed as is, like in Level 1. The snapshot of the session is only
+    leased from `pool` for the execution, as the model calls before may wait
+    long in the admission queue. With `speculate`, the generated SQL is
+    executed on a throwaway snapshot of the pool while the safeguard runs.
+    Read-only statements are answered by `result_cache` when it has their
+    results.
+    """
+    hooks = hooks or LevelHooks()
+    with hooks.stage("sql_generation"), span("sql_generation", level):
+        generated_sql = hooks.stream(
+            lambda callbacks: chain.invoke(
+                {"question": question}, config={"callbacks": callbacks}
+            )
+        )
+    result = LevelResult(generated_sql)
+    speculation = None
+
+    if safeguard_llm is None:
+        statements = split_statements(generated_sql)
+    else:
+        with hooks.stage("classification"), span("classification", level) as record:
+            result.kind = classifier.classify(generated_sql)
+            record["kind"] = result.kind.value
+        if result.kind in skip_safeguard_for:
+            hooks.safeguard_skipped(result.kind)
+            result.safe_query = generated_sql
+        else:
+            if speculate and pool.is_pristine(session_id):
+                speculation = SpeculativeExecution(
+                    pool,
+                    safe_statements(generated_sql),
+                    budget,
+                    result_cache,
+                )
+            with hooks.stage("safeguard"), span("safeguard", level):
+                result.safe_query = run_safeguard(
+                    safeguard_llm, generated_sql, hooks.stream
+                )
+            if result.safe_query is None:
+                return result
+        statements = safe_statements(result.safe_query)
+
+    with hooks.stage("sql_execution"), span("sql_execution", level) as record:
+        batch = speculation.result_for(statements) if speculation else None
+        record["speculative"] = batch is not None
+        if batch is None:
+            with pool.lease(session_id) as snapshot:
+                batch = execute_batch(snapshot, statements, budget, result_cache)
+        result.batch = batch
+        record["statements"] = len(statements)
+        record["modified"] = result.batch.modified
+        record["cached"] = sum(statement.cached for statement in result.batch.results)
+    return result
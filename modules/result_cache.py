@@ -0,0 +1,106 @@
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import replace
+from typing import Callable, Hashable, Optional
+
+from modules.executor import StatementResult
+from modules.sql_classifier import SQLClassifier, StatementKind, keywords, normalize_sql
+
+# Functions whose result differs between two runs on the same data
+_NONDETERMINISTIC = {
+    "CHANGES",
+    "CURRENT_DATE",
+    "CURRENT_TIME",
+    "CURRENT_TIMESTAMP",
+    "DATE",
+    "DATETIME",
+    "JULIANDAY",
+    "LAST_INSERT_ROWID",
+    "RANDOM",
+    "RANDOMBLOB",
+    "STRFTIME",
+    "TIME",
+    "TOTAL_CHANGES",
+    "UNIXEPOCH",
+}
+
+
+def _result_bytes(result: StatementResult) -> int:
+    """Estimated memory held by the rows and columns of a result"""
+    size = sys.getsizeof(result.rows) + sum(map(sys.getsizeof, result.columns))
+    for row in result.rows:
+        size += sys.getsizeof(row) + sum(map(sys.getsizeof, row))
+    return size
+
+
+class ResultCache:
+    """
+    Results of read-only statements run on the golden state of the database.
+
+    Entries are keyed by the normalized statement, the row budget and the
+    version of the golden database, so a new golden database never serves
+    old results. Only statements the classifier proves read-only and
+    deterministic are cached. The least recently used entries are evicted
+    once the results together exceed `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        classifier: SQLClassifier,
+        version: Callable[[], str],
+        max_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.classifier = classifier
+        self.version = version
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, tuple[StatementResult, int]] = (
+            OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, statement: str, max_rows: int) -> Optional[Hashable]:
+        """Cache key of the statement, None if its results must not be cached"""
+        if _NONDETERMINISTIC.intersection(keywords(statement)):
+            return None
+        if self.classifier.classify_statement(statement) != StatementKind.READ_ONLY:
+            return None
+        return (self.version(), max_rows, normalize_sql(statement))
+
+    def get(self, key: Hashable, statement: str) -> Optional[StatementResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Rows are shared between sessions and must not be mutated
+        return replace(entry[0], statement=statement, duration_ms=0.0, cached=True)
+
+    def put(self, key: Hashable, result: StatementResult) -> None:
+        if result.error is not None or result.aborted:
+            return
+        size = _result_bytes(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
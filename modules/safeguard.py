@@ -0,0 +1,84 @@
+from typing import Callable, Optional
+
+from langchain.schema import HumanMessage
+from langchain_core.callbacks.base import Callbacks
+from langchain_core.language_models import BaseChatModel
+
+from modules.llm_cache import cache_stopped_response
+from modules.sql_classifier import split_statements
+from modules.streaming import StreamStopped, collect_stream, has_closed_sql_block
+
+SAFEGUARD_PROMPT = """
+You are a SQL expert and check the generated SQL query for malicious SQL code.
+
+Malicious code is defined as any SQL code that modifies and/or deletes and/or drops the table and/or it's data. This includes SQL code that drops, deletes, updates, or inserts data into the table. Dropping tables is also considered as malicious.
+
+If you find malicious SQL, please remove it. Just return the SQL query without the malicious SQL code. If you don't find any malicious SQL, just return the SQL query as is.
+
+Check the generated SQL query for malicious code:
+=======================
+{openai_response}
+=======================
+
+Make sure to follow the output format below.
+
+Output format:
+=======================
+Reasoning as to why the SQL query is malicious or not.
+
+SQL query without malicious code:
+'''
+[INSERT_SAFE_SQL_QUERY_OR_EMPTY_STRING]
+'''
+"""
+
+
+def _generate_safeguard(
+    llm: BaseChatModel, openai_response: str
+) -> Callable[[Callbacks], str]:
+    messages = [
+        HumanMessage(content=SAFEGUARD_PROMPT.format(openai_response=openai_response))
+    ]
+
+    def generate(callbacks: Callbacks) -> str:
+        try:
+            result = llm.generate(messages=[messages], callbacks=callbacks)
+        except StreamStopped as e:
+            # The answer is complete once its SQL block is closed
+            cache_stopped_response(llm, messages, e.text)
+            raise
+        return result.generations[0][0].text
+
+    return generate
+
+
+def extract_safe_query(safeguard_output: str) -> Optional[str]:
+    """SQL query inside the ''' block of the safeguard output, if any"""
+    parts = safeguard_output.split("'''")
+    return parts[1] if len(parts) > 1 else None
+
+
+def safe_statements(safe_query: str) -> list[str]:
+    """Statements of the safe query, without the placeholder of the output format"""
+    return [
+        statement for statement in split_statements(safe_query) if "[" not in statement
+    ]
+
+
+def run_safeguard(
+    llm: BaseChatModel,
+    openai_response: str,
+    stream: Callable[..., str] = collect_stream,
+) -> Optional[str]:
+    """
+    Return the SQL query the safeguard kept, None if it returned none.
+
+    The answer is read with `stream`, like `collect_stream` or `stream_code`,
+    and aborted once its SQL block is complete.
+    """
+    return extract_safe_query(
+        stream(
+            _generate_safeguard(llm, openai_response),
+            stop_after=has_closed_sql_block,
+        )
+    )
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import re
+from collections import defaultdict
+from functools import lru_cache
+from typing import Optional
+
+import streamlit as st
+from langchain.chains import create_sql_query_chain
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnablePassthrough
+from sqlalchemy import Engine, inspect
+
+from modules.sqlite_profile import create_golden_engine, sqlite_profile
+from modules.utils import BACKUP_DB
+
+# Words found in more tables than this, like "name", select none of them
+MAX_TABLES_PER_KEYWORD = 3
+# Shorter words, like the "to" of "ReportsTo", are too common in questions
+MIN_KEYWORD_LENGTH = 3
+# Words players use for the Chinook tables without naming them
+SYNONYMS = {
+    "band": "artist",
+    "singer": "artist",
+    "musician": "artist",
+    "record": "album",
+    "song": "track",
+    "music": "track",
+    "style": "genre",
+    "format": "mediatype",
+    "client": "customer",
+    "buyer": "customer",
+    "user": "customer",
+    "staff": "employee",
+    "manager": "employee",
+    "order": "invoice",
+    "purchase": "invoice",
+    "sale": "invoice",
+    "bill": "invoice",
+}
+
+_WORD_PATTERN = re.compile(r"[A-Za-z]+")
+_CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+")
+
+
+def _stem(word: str) -> str:
+    """Lowercase singular of a word, good enough for table and column names"""
+    word = word.lower()
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _name_words(name: str) -> set[str]:
+    return {_stem(word) for word in _CAMEL_CASE_PATTERN.findall(name)} - {"id"}
+
+
+class SchemaIndex:
+    """
+    Keyword index over the tables and columns of a database.
+
+    A question selects the tables it names, directly, through a synonym or
+    through a distinctive column word, plus their foreign key neighbours so
+    the model can still write the joins. Questions matching no table select
+    all of them.
+    """
+
+    def __init__(
+        self, columns: dict[str, list[str]], foreign_keys: dict[str, set[str]]
+    ) -> None:
+        self.tables = sorted(columns)
+        self._neighbours: dict[str, set[str]] = defaultdict(set)
+        for table, referred in foreign_keys.items():
+            for other in referred - {table}:
+                self._neighbours[table].add(other)
+                self._neighbours[other].add(table)
+
+        # Whole table names first, then the words of compound table names
+        # like "line" and finally the distinctive words of column names
+        self._keywords = {_stem(table): {table} for table in self.tables}
+        for names in (
+            {table: [table] for table in self.tables},
+            columns,
+        ):
+            word_tables: dict[str, set[str]] = defaultdict(set)
+            for table, table_names in names.items():
+                for name in table_names:
+                    for word in _name_words(name):
+                        word_tables[word].add(table)
+            for word, tables in word_tables.items():
+                if (
+                    word not in self._keywords
+                    and len(word) >= MIN_KEYWORD_LENGTH
+                    and len(tables) <= MAX_TABLES_PER_KEYWORD
+                ):
+                    self._keywords[word] = tables
+        for synonym, keyword in SYNONYMS.items():
+            if keyword in self._keywords:
+                self._keywords.setdefault(synonym, self._keywords[keyword])
+
+    @classmethod
+    def from_engine(cls, engine: Engine) -> "SchemaIndex":
+        inspector = inspect(engine)
+        columns, foreign_keys = {}, {}
+        for table in inspector.get_table_names():
+            columns[table] = [column["name"] for column in inspector.get_columns(table)]
+            foreign_keys[table] = {
+                key["referred_table"] for key in inspector.get_foreign_keys(table)
+            }
+        return cls(columns, foreign_keys)
+
+    def select_tables(self, question: str) -> list[str]:
+        words = _WORD_PATTERN.findall(question)
+        # Joined pairs match tables written as two words, like "invoice line"
+        candidates = {_stem(word) for word in words} | {
+            _stem(first + second) for first, second in zip(words, words[1:])
+        }
+        matched = set()
+        for word in candidates:
+            matched |= self._keywords.get(word, set())
+        if not matched:
+            return self.tables
+        selected = set(matched)
+        for table in matched:
+            selected |= self._neighbours[table]
+        return sorted(selected)
+
+
+@lru_cache
+def _calculate_file_checksum(file_path: str, mtime_ns: int, size: int) -> str:
+    sha256_hash = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        # Read and update hash string value in blocks of 4K
+        for byte_block in iter(lambda: f.read(4096), b""):
+            sha256_hash.update(byte_block)
+    return sha256_hash.hexdigest()
+
+
+def golden_version() -> str:
+    """Checksum of the golden database, only recomputed when the file changes"""
+    stat = os.stat(BACKUP_DB)
+    return _calculate_file_checksum(BACKUP_DB, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache
+def golden_engine() -> Engine:
+    """
+    Read-only engine on the golden database, shared by the schema loaders.
+
+    It only reflects the schema and renders the sample rows, once per golden
+    version, so a single connection is kept. The SQL of the players runs on
+    their session snapshots instead.
+    """
+    return create_golden_engine(BACKUP_DB, sqlite_profile(), pool_size=1)
+
+
+def describe_tables(engine: Engine, sample_rows: int) -> SQLDatabase:
+    """Database whose CREATE TABLE statements and sample rows are prerendered"""
+    database = SQLDatabase(engine, sample_rows_in_table_info=sample_rows)
+    table_info = {
+        table: database.get_table_info([table])
+        for table in database.get_usable_table_names()
+    }
+    return SQLDatabase(engine, custom_table_info=table_info)
+
+
+@st.cache_resource(show_spinner="Loading schema ...")
+def load_schema_database(version: str) -> SQLDatabase:
+    """
+    Read-only golden database with precomputed table descriptions.
+
+    The CREATE TABLE statements and sample rows of every table are rendered
+    once per golden version, so building prompts no longer queries SQLite.
+    The number of sample rows per table is capped by SCHEMA_SAMPLE_ROWS.
+    """
+    sample_rows = int(os.environ.get("SCHEMA_SAMPLE_ROWS", 3))
+    return describe_tables(golden_engine(), sample_rows)
+
+
+@st.cache_resource(show_spinner=False)
+def load_schema_index(version: str) -> SchemaIndex:
+    return SchemaIndex.from_engine(golden_engine())
+
+
+def build_sql_query_chain(
+    llm: BaseChatModel, database: SQLDatabase, index: Optional[SchemaIndex] = None
+) -> Runnable:
+    """
+    SQL generation chain, taking a question as input.
+
+    With an index, the prompt only describes the tables selected for the
+    question instead of the whole schema.
+    """
+    chain = create_sql_query_chain(llm=llm, db=database)
+    if index is None:
+        return chain
+    return (
+        RunnablePassthrough.assign(
+            table_names_to_use=lambda x: index.select_tables(x["question"])
+        )
+        | chain
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _load_sql_query_chain(_llm: BaseChatModel, model: str, version: str) -> Runnable:
+    pruning = os.environ.get("SCHEMA_PRUNING", "1") == "1"
+    return build_sql_query_chain(
+        _llm,
+        load_schema_database(version),
+        load_schema_index(version) if pruning else None,
+    )
+
+
+def load_sql_query_chain(llm: BaseChatModel) -> Runnable:
+    """SQL generation chain shared by all levels and sessions using the model"""
+    return _load_sql_query_chain(llm, llm.model_name, golden_version())
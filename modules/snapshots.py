@@ -0,0 +1,243 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+
+from modules.change_tracker import ChangeTracker
+from modules.sqlite_profile import SQLiteProfile, connect_golden
+
+
+@dataclass
+class Snapshot:
+    """In-memory copy of the golden database owned by a single session"""
+
+    connection: sqlite3.Connection
+    engine: Engine
+    tracker: ChangeTracker
+    last_used: float = field(default_factory=time.monotonic)
+    # Set when statements committed on their own and a rollback cannot undo them
+    dirty: bool = False
+    # Number of callers running statements on it, see SnapshotPool.lease
+    leases: int = 0
+    # Set when the session was released while the snapshot was leased
+    released: bool = False
+
+    def close(self) -> None:
+        self.engine.dispose()
+        self.connection.close()
+
+
+class SnapshotPool:
+    """
+    Hands out isolated in-memory copies of the golden database, one per session.
+
+    Snapshots are copied with the sqlite3 backup API ahead of time, so a new
+    session only pops a ready one while a background thread refills the spares.
+    Sessions are kept in least recently used order and the oldest ones are
+    evicted when the session limit or the memory cap would be exceeded.
+    Leased snapshots are never evicted, so the limits may be exceeded while
+    more sessions than they allow run statements at once.
+    """
+
+    def __init__(
+        self,
+        golden_path: str,
+        spares: int = 4,
+        max_sessions: int = 300,
+        max_memory_bytes: int = 512 * 1024 * 1024,
+        idle_timeout: float = 60 * 60,
+        profile: SQLiteProfile = SQLiteProfile(),
+    ) -> None:
+        # Snapshots keep the SQLite defaults, tuning them made no difference
+        self._golden = connect_golden(golden_path, profile)
+        page_count = self._golden.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._golden.execute("PRAGMA page_size").fetchone()[0]
+        self.snapshot_bytes = page_count * page_size
+        self.spares = spares
+        self.max_sessions = max_sessions
+        self.max_memory_bytes = max_memory_bytes
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._golden_lock = threading.Lock()
+        self._refill = threading.Event()
+        self._sessions: OrderedDict[str, Snapshot] = OrderedDict()
+        self._spare_snapshots: list[Snapshot] = [
+            self._build_snapshot() for _ in range(spares)
+        ]
+        threading.Thread(target=self._refill_spares, daemon=True).start()
+
+    @property
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Estimated memory held by session and spare snapshots"""
+        return (len(self._sessions) + len(self._spare_snapshots)) * self.snapshot_bytes
+
+    def acquire(self, session_id: str) -> Snapshot:
+        """
+        Return the snapshot of the session, assigning a fresh one if needed.
+
+        The snapshot may be evicted for newer sessions as soon as it is
+        returned, callers running statements on it lease it instead.
+        """
+        return self._assign(session_id, leases=0)
+
+    @contextmanager
+    def lease(self, session_id: str) -> Iterator[Snapshot]:
+        """Snapshot of the session, kept open while statements run on it"""
+        snapshot = self._assign(session_id, leases=1)
+        try:
+            yield snapshot
+        finally:
+            self._return(snapshot)
+
+    def is_pristine(self, session_id: str) -> bool:
+        """Whether the session holds the golden state, with or without a snapshot"""
+        with self._lock:
+            snapshot = self._sessions.get(session_id)
+        return snapshot is None or not snapshot.dirty
+
+    def borrow(self) -> Snapshot:
+        """
+        Take a pristine snapshot owned by no session, to be closed after use.
+
+        Borrowed snapshots are not counted against the session limits. They
+        are sandboxed, so statements run on them cannot leave anything behind
+        once the executor rolled them back, like an attached database file.
+        """
+        with self._lock:
+            snapshot = self._spare_snapshots.pop() if self._spare_snapshots else None
+        self._refill.set()
+        snapshot = snapshot or self._build_snapshot()
+        snapshot.tracker.sandbox()
+        return snapshot
+
+    def reset(self, session_id: str) -> None:
+        """
+        Restore the session snapshot to the golden state in place.
+
+        Attempts are rolled back by the executor, so usually only the change
+        tracker is cleared. Dirty snapshots, and snapshots whose last batch
+        modified the database, get a fresh copy of the golden database behind
+        their engine, so the engine of the session stays valid. Copying the
+        pages into the existing connection would keep its settings, like
+        pragmas, which make it answer differently.
+        """
+        with self._lock:
+            snapshot = self._sessions.get(session_id)
+            if snapshot is None:
+                return
+            snapshot.leases += 1
+        try:
+            if snapshot.dirty or snapshot.tracker.modified:
+                connection = snapshot.connection
+                snapshot.connection = self._copy_golden()
+                # The engine reconnects through its creator, to the fresh copy
+                snapshot.engine.dispose()
+                connection.close()
+                snapshot.dirty = False
+            snapshot.tracker.reset()
+        finally:
+            self._return(snapshot)
+
+    def release(self, session_id: str) -> None:
+        """Drop the snapshot of the session, once it is no longer leased"""
+        with self._lock:
+            snapshot = self._sessions.pop(session_id, None)
+            if snapshot is None:
+                return
+            snapshot.released = True
+            if snapshot.leases:
+                # Closed by the last lease returning it
+                return
+        snapshot.close()
+
+    def _assign(self, session_id: str, leases: int) -> Snapshot:
+        with self._lock:
+            snapshot = self._sessions.get(session_id)
+            if snapshot is not None:
+                self._sessions.move_to_end(session_id)
+                snapshot.last_used = time.monotonic()
+                snapshot.leases += leases
+                return snapshot
+            self._evict()
+            snapshot = self._spare_snapshots.pop() if self._spare_snapshots else None
+        self._refill.set()
+        if snapshot is None:
+            snapshot = self._build_snapshot()
+        snapshot.leases = leases
+        with self._lock:
+            assigned = self._sessions.setdefault(session_id, snapshot)
+            if assigned is not snapshot:
+                # Another thread assigned one to the session meanwhile
+                assigned.leases += leases
+        if assigned is not snapshot:
+            snapshot.close()
+        return assigned
+
+    def _return(self, snapshot: Snapshot) -> None:
+        with self._lock:
+            snapshot.leases -= 1
+            snapshot.last_used = time.monotonic()
+            closing = snapshot.released and not snapshot.leases
+        if closing:
+            snapshot.close()
+
+    def _evict(self) -> None:
+        """Make room for one more session, oldest and idle sessions first"""
+        now = time.monotonic()
+        max_snapshots = min(
+            self.max_sessions + self.spares,
+            self.max_memory_bytes // self.snapshot_bytes,
+        )
+        for session_id, snapshot in list(self._sessions.items()):
+            idle = now - snapshot.last_used > self.idle_timeout
+            full = len(self._sessions) + self.spares >= max_snapshots
+            if not (idle or full):
+                break
+            if snapshot.leases:
+                continue
+            del self._sessions[session_id]
+            snapshot.close()
+
+    def _refill_spares(self) -> None:
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while len(self._spare_snapshots) < self.spares:
+                snapshot = self._build_snapshot()
+                with self._lock:
+                    self._spare_snapshots.append(snapshot)
+
+    def _copy_golden(self) -> sqlite3.Connection:
+        # Transactions are emitted by SQLAlchemy instead of the sqlite3 module,
+        # which would otherwise autocommit DDL statements
+        connection = sqlite3.connect(
+            ":memory:", check_same_thread=False, isolation_level=None
+        )
+        with self._golden_lock:
+            self._golden.backup(connection)
+        return connection
+
+    def _build_snapshot(self) -> Snapshot:
+        tracker = ChangeTracker()
+        # Connects lazily, to the current connection of the snapshot
+        engine = create_engine(
+            "sqlite://", creator=lambda: snapshot.connection, poolclass=StaticPool
+        )
+        event.listen(engine, "begin", lambda conn: conn.exec_driver_sql("BEGIN"))
+        tracker.attach(engine)
+        snapshot = Snapshot(
+            connection=self._copy_golden(), engine=engine, tracker=tracker
+        )
+        return snapshot
@@ -0,0 +1,73 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from modules.executor import BatchResult, QueryBudget, execute_batch
+from modules.result_cache import ResultCache
+from modules.snapshots import SnapshotPool
+
+
+@lru_cache
+def _executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=int(os.environ.get("SPECULATION_WORKERS", 8)),
+        thread_name_prefix="speculation",
+    )
+
+
+def _execute_on_borrowed(
+    pool: SnapshotPool,
+    statements: list[str],
+    budget: Optional[QueryBudget],
+    cache: Optional[ResultCache],
+) -> tuple[BatchResult, bool]:
+    snapshot = pool.borrow()
+    try:
+        batch = execute_batch(snapshot, statements, budget, cache)
+        # Statements refused by the sandbox must run on the session for real
+        return batch, snapshot.dirty or snapshot.tracker.denied
+    finally:
+        # Whatever ran on it, the snapshot is never handed out again
+        snapshot.close()
+
+
+class SpeculativeExecution:
+    """
+    Statements executed ahead of time on a throwaway copy of the golden
+    database, while the safeguard is still deciding what to keep.
+
+    The result is only used if the safeguard kept exactly these statements,
+    otherwise it is discarded. The statements run before the safeguard
+    decided anything, so the copy is sandboxed: they can neither attach a
+    database file nor commit, and nothing of them outlives the rollback.
+    """
+
+    def __init__(
+        self,
+        pool: SnapshotPool,
+        statements: list[str],
+        budget: Optional[QueryBudget] = None,
+        cache: Optional[ResultCache] = None,
+    ) -> None:
+        self.statements = statements
+        self._future: Future[tuple[BatchResult, bool]] = _executor().submit(
+            _execute_on_borrowed, pool, statements, budget, cache
+        )
+
+    def result_for(self, statements: list[str]) -> Optional[BatchResult]:
+        """The precomputed result if `statements` are the speculated ones"""
+        if statements != self.statements:
+            self._future.cancel()
+            return None
+        if self._future.cancel():
+            # Still waiting for a worker, running it now is as fast
+            return None
+        batch, unusable = self._future.result()
+        # Statements with lasting effects, or refused by the sandbox, must run
+        # on the session for real
+        return None if unusable else batch
+
+
+def speculation_enabled() -> bool:
+    return os.environ.get("SPECULATIVE_EXECUTION", "1") == "1"
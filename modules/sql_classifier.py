@@ -0,0 +1,188 @@
+import re
+import sqlite3
+import threading
+from enum import Enum
+from typing import Optional
+
+from modules.sqlite_profile import golden_uri
+
+# Comments, string literals and quoted identifiers are skipped, words are kept
+_TOKEN_PATTERN = re.compile(
+    r"""
+    --[^\n]*
+    | /\*.*?(?:\*/|$)
+    | '(?:[^']|'')*'?
+    | "(?:[^"]|"")*"?
+    | `[^`]*`?
+    | \[[^\]]*\]?
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# Literals and quoted identifiers are kept as is, comments and whitespace not
+_NORMALIZE_PATTERN = re.compile(
+    r"""
+    (?P<literal>'(?:[^']|'')*'?|"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+    | (?:--[^\n]*|/\*.*?(?:\*/|$)|\s)+
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_READ_KEYWORDS = {"SELECT", "VALUES", "WITH"}
+_WRITE_KEYWORDS = {
+    "ALTER",
+    "ATTACH",
+    "CREATE",
+    "DELETE",
+    "DETACH",
+    "DROP",
+    "INSERT",
+    "REINDEX",
+    "REPLACE",
+    "UPDATE",
+    "VACUUM",
+}
+# Authorizer actions a read-only statement may perform
+_READ_ACTIONS = {
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_RECURSIVE,
+    sqlite3.SQLITE_SELECT,
+}
+_WRITE_ACTIONS = {
+    sqlite3.SQLITE_ALTER_TABLE,
+    sqlite3.SQLITE_ATTACH,
+    sqlite3.SQLITE_CREATE_INDEX,
+    sqlite3.SQLITE_CREATE_TABLE,
+    sqlite3.SQLITE_CREATE_TEMP_INDEX,
+    sqlite3.SQLITE_CREATE_TEMP_TABLE,
+    sqlite3.SQLITE_CREATE_TEMP_TRIGGER,
+    sqlite3.SQLITE_CREATE_TEMP_VIEW,
+    sqlite3.SQLITE_CREATE_TRIGGER,
+    sqlite3.SQLITE_CREATE_VIEW,
+    sqlite3.SQLITE_CREATE_VTABLE,
+    sqlite3.SQLITE_DELETE,
+    sqlite3.SQLITE_DETACH,
+    sqlite3.SQLITE_DROP_INDEX,
+    sqlite3.SQLITE_DROP_TABLE,
+    sqlite3.SQLITE_DROP_TEMP_INDEX,
+    sqlite3.SQLITE_DROP_TEMP_TABLE,
+    sqlite3.SQLITE_DROP_TEMP_TRIGGER,
+    sqlite3.SQLITE_DROP_TEMP_VIEW,
+    sqlite3.SQLITE_DROP_TRIGGER,
+    sqlite3.SQLITE_DROP_VIEW,
+    sqlite3.SQLITE_DROP_VTABLE,
+    sqlite3.SQLITE_INSERT,
+    sqlite3.SQLITE_UPDATE,
+}
+# Table-valued pragmas report updates of these tables when SQLite prepares
+# them, while statements cannot modify them unless `PRAGMA writable_schema`
+_SCHEMA_TABLES = {"sqlite_master", "sqlite_temp_master"}
+
+
+class StatementKind(Enum):
+    READ_ONLY = "read-only"
+    MUTATING = "mutating"
+    AMBIGUOUS = "ambiguous"
+
+
+def split_statements(sql: str) -> list[str]:
+    """
+    Split SQL into statements, ignoring semicolons inside literals and comments.
+
+    A statement ends at the first semicolon for which
+    `sqlite3.complete_statement` agrees. Empty statements are dropped.
+    """
+    statements = []
+    current = ""
+    for piece in sql.split(";"):
+        current += piece + ";"
+        if sqlite3.complete_statement(current):
+            statements.append(current)
+            current = ""
+    statements.append(current[:-1])
+    return [
+        statement.strip()
+        for statement in statements
+        if any(match.group("word") for match in _TOKEN_PATTERN.finditer(statement))
+    ]
+
+
+def normalize_sql(statement: str) -> str:
+    """
+    Statement with comments dropped and whitespace collapsed, outside literals.
+
+    Letter case is kept, as it shows in the column names of the results.
+    """
+    normalized = _NORMALIZE_PATTERN.sub(
+        lambda match: match.group("literal") or " ", statement
+    )
+    return normalized.strip().rstrip("; ")
+
+
+def keywords(statement: str) -> list[str]:
+    """Upper-cased words of the statement outside of literals and comments"""
+    return [
+        match.group("word").upper()
+        for match in _TOKEN_PATTERN.finditer(statement)
+        if match.group("word")
+    ]
+
+
+class SQLClassifier:
+    """
+    Labels statements as read-only, mutating or ambiguous without running them.
+
+    Statements are first triaged by their leading keyword. Candidates for
+    read-only are then prepared with EXPLAIN against an empty copy of the
+    schema, and the authorizer reports every action SQLite would perform.
+    """
+
+    def __init__(self, schema_path: str) -> None:
+        golden = sqlite3.connect(golden_uri(schema_path), uri=True)
+        schema = golden.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL"
+            " AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        golden.close()
+
+        self._lock = threading.Lock()
+        self._actions: set[int] = set()
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        for (sql,) in schema:
+            self._connection.execute(sql)
+        self._connection.set_authorizer(self._authorize)
+
+    def _authorize(self, action: int, table: Optional[str], *_) -> int:
+        if not (action == sqlite3.SQLITE_UPDATE and table in _SCHEMA_TABLES):
+            self._actions.add(action)
+        return sqlite3.SQLITE_OK
+
+    def classify_statement(self, statement: str) -> StatementKind:
+        words = keywords(statement)
+        if not words:
+            return StatementKind.READ_ONLY
+        if words[0] in _WRITE_KEYWORDS:
+            return StatementKind.MUTATING
+        with self._lock:
+            self._actions = set()
+            try:
+                self._connection.execute(f"EXPLAIN {statement}")
+            except (sqlite3.Error, sqlite3.Warning):
+                return StatementKind.AMBIGUOUS
+            actions = self._actions
+        if actions & _WRITE_ACTIONS:
+            return StatementKind.MUTATING
+        if words[0] in _READ_KEYWORDS and actions <= _READ_ACTIONS:
+            return StatementKind.READ_ONLY
+        return StatementKind.AMBIGUOUS
+
+    def classify(self, sql: str) -> StatementKind:
+        """Label a batch of statements by its least safe statement"""
+        kinds = {self.classify_statement(s) for s in split_statements(sql)}
+        if StatementKind.MUTATING in kinds:
+            return StatementKind.MUTATING
+        if StatementKind.AMBIGUOUS in kinds:
+            return StatementKind.AMBIGUOUS
+        return StatementKind.READ_ONLY
@@ -0,0 +1,82 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+# The leaderboard page only needs the pragmas, not SQLAlchemy
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+
+@dataclass(frozen=True)
+class SQLiteProfile:
+    """Pragmas applied to every connection opened on a SQLite database"""
+
+    cache_size_kib: int = 64 * 1024
+    mmap_size_bytes: int = 256 * 1024 * 1024
+    temp_store: str = "MEMORY"
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+
+    def pragmas(self, in_memory: bool = False, read_only: bool = False) -> list[str]:
+        # Negative cache sizes are in KiB rather than in pages
+        pragmas = [
+            f"PRAGMA cache_size = -{self.cache_size_kib}",
+            f"PRAGMA temp_store = {self.temp_store}",
+        ]
+        if not in_memory:
+            pragmas.append(f"PRAGMA mmap_size = {self.mmap_size_bytes}")
+        if not (in_memory or read_only):
+            pragmas.append(f"PRAGMA journal_mode = {self.journal_mode}")
+            pragmas.append(f"PRAGMA synchronous = {self.synchronous}")
+        return pragmas
+
+    def apply(
+        self,
+        connection: sqlite3.Connection,
+        in_memory: bool = False,
+        read_only: bool = False,
+    ) -> None:
+        for pragma in self.pragmas(in_memory, read_only):
+            connection.execute(pragma)
+
+
+@lru_cache
+def sqlite_profile() -> SQLiteProfile:
+    """Profile of the app, tuned through the environment"""
+    return SQLiteProfile(
+        cache_size_kib=int(os.environ.get("SQLITE_CACHE_SIZE_MB", 64)) * 1024,
+        mmap_size_bytes=int(os.environ.get("SQLITE_MMAP_SIZE_MB", 256)) * 1024 * 1024,
+        temp_store=os.environ.get("SQLITE_TEMP_STORE", "MEMORY"),
+    )
+
+
+def golden_uri(path: str) -> str:
+    """
+    URI opening the golden database read-only and immutable.
+
+    SQLite then skips locking and change detection, which is safe as long as
+    the file is never written while the app runs.
+    """
+    return f"file:{path}?mode=ro&immutable=1"
+
+
+def connect_golden(path: str, profile: SQLiteProfile) -> sqlite3.Connection:
+    connection = sqlite3.connect(golden_uri(path), uri=True, check_same_thread=False)
+    profile.apply(connection, read_only=True)
+    return connection
+
+
+def create_golden_engine(path: str, profile: SQLiteProfile, pool_size: int) -> "Engine":
+    """Engine keeping up to `pool_size` tuned golden connections open"""
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    return create_engine(
+        "sqlite://",
+        creator=lambda: connect_golden(path, profile),
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+    )
@@ -0,0 +1,103 @@
+import logging
+from typing import Any, Callable, Optional
+
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.base import Callbacks
+
+from modules.cancellation import check_cancelled
+
+
+class StreamStopped(Exception):
+    """Raised by StopStream to abort a completion once it has enough tokens"""
+
+    def __init__(self, text: str) -> None:
+        super().__init__(text)
+        self.text = text
+
+
+class _ExpectedStops(logging.Filter):
+    """Drop the warnings langchain logs for every stream aborted on purpose"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        return not any(
+            f"callback: {name}(" in message for name in ("StreamStopped", "Cancelled")
+        )
+
+
+logging.getLogger("langchain_core.callbacks.manager").addFilter(_ExpectedStops())
+
+
+class StopStream(BaseCallbackHandler):
+    """
+    Collect the tokens of a streaming model, aborting once `stop_after` holds.
+
+    The completion is also aborted, with Cancelled, once the submission it
+    runs in was cancelled.
+    """
+
+    raise_error = True
+
+    def __init__(self, stop_after: Optional[Callable[[str], bool]] = None) -> None:
+        self.stop_after = stop_after
+        self.text = ""
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        check_cancelled()
+        self.text += token
+        if self.stop_after is not None and self.stop_after(self.text):
+            raise StreamStopped(self.text)
+
+
+class StreamToCode(StopStream):
+    """Render the tokens of a streaming model into a code block as they arrive"""
+
+    def __init__(self, stop_after: Optional[Callable[[str], bool]] = None) -> None:
+        super().__init__(stop_after)
+        self.placeholder = st.empty()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        # Before rendering, which would stop a rerun page without counting it
+        check_cancelled()
+        self.placeholder.code(self.text + token, language="sql")
+        super().on_llm_new_token(token, **kwargs)
+
+
+def collect_stream(
+    generate: Callable[[Callbacks], str],
+    stop_after: Optional[Callable[[str], bool]] = None,
+    handler: Optional[StopStream] = None,
+) -> str:
+    """
+    Run `generate` with a callback collecting its tokens, without rendering.
+
+    When `stop_after` returns True for the text received so far, the
+    completion is aborted and that text is returned right away.
+    """
+    handler = handler or StopStream(stop_after)
+    try:
+        return generate([handler])
+    except StreamStopped as e:
+        return e.text
+
+
+def stream_code(
+    generate: Callable[[Callbacks], str],
+    stop_after: Optional[Callable[[str], bool]] = None,
+) -> str:
+    """
+    Like `collect_stream`, streaming the tokens into a code block.
+
+    Responses served from the cache arrive without tokens and are rendered
+    at the end.
+    """
+    handler = StreamToCode(stop_after)
+    text = collect_stream(generate, handler=handler)
+    handler.placeholder.code(text, language="sql")
+    return text
+
+
+def has_closed_sql_block(text: str) -> bool:
+    """Check if the safeguard output contains a complete ''' SQL block"""
+    return text.count("'''") >= 2
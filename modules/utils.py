@@ -1,11 +1,32 @@
-import hashlib
-import shutil
+import os
+import weakref
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import streamlit as st
-from langchain_community.utilities import SQLDatabase
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# The database, model and pandas modules are imported where they are used,
+# so pages that only need the sidebar load fast
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.runnables import Runnable
+
+    from modules.executor import BatchResult, QueryBudget, StatementResult
+    from modules.result_cache import ResultCache
+    from modules.snapshots import SnapshotPool
+    from modules.sql_classifier import SQLClassifier, StatementKind
 
-WORKING_DB = "data/chinook_working.db"
 BACKUP_DB = "data/chinook_backup.db"
+RESULT_PAGE_SIZE = 100
+# Headings rendered before the stages of the level pages
+STAGE_HEADINGS = {
+    "sql_generation": "### Generated SQL:",
+    "classification": "### LLM Safeguard Result:",
+}
+# Stages calling a model, whose calls may wait in the admission queue
+MODEL_STAGES = {"sql_generation", "safeguard"}
 
 
 def set_sidebar() -> None:
@@ -31,31 +52,140 @@ def set_sidebar() -> None:
         st.markdown("---")
 
 
+@lru_cache
+def query_budget() -> "QueryBudget":
+    """Budget applied to every generated SQL statement"""
+    from modules.executor import QueryBudget
+
+    return QueryBudget(
+        timeout_seconds=float(os.environ.get("QUERY_TIMEOUT_SECONDS", 2.0)),
+        max_vm_steps=int(os.environ.get("QUERY_MAX_VM_STEPS", 50_000_000)),
+        max_rows=int(os.environ.get("QUERY_MAX_ROWS", 1000)),
+    )
+
+
 @st.cache_resource(show_spinner="Loading database ...")
-def load_database() -> SQLDatabase:
-    return SQLDatabase.from_uri(f"sqlite:///{WORKING_DB}")
+def load_snapshot_pool() -> "SnapshotPool":
+    from modules.snapshots import SnapshotPool
+    from modules.sqlite_profile import sqlite_profile
+
+    return SnapshotPool(
+        BACKUP_DB,
+        spares=int(os.environ.get("SNAPSHOT_SPARES", 4)),
+        max_sessions=int(os.environ.get("SNAPSHOT_MAX_SESSIONS", 300)),
+        max_memory_bytes=int(os.environ.get("SNAPSHOT_MAX_MEMORY_MB", 512))
+        * 1024
+        * 1024,
+        profile=sqlite_profile(),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def load_sql_classifier() -> "SQLClassifier":
+    from modules.sql_classifier import SQLClassifier
+
+    return SQLClassifier(BACKUP_DB)
+
+
+@st.cache_resource(show_spinner=False)
+def load_result_cache() -> "ResultCache":
+    """Results of read-only statements shared by all sessions"""
+    from modules.result_cache import ResultCache
+    from modules.schema import golden_version
+
+    return ResultCache(
+        load_sql_classifier(),
+        golden_version,
+        max_bytes=int(os.environ.get("RESULT_CACHE_MAX_MB", 64)) * 1024 * 1024,
+    )
+
 
+def _session_id() -> str:
+    return get_script_run_ctx().session_id
 
-def _reset_database() -> SQLDatabase:
-    """Copy original database to working database"""
-    shutil.copyfile(f"./{BACKUP_DB}", f"./{WORKING_DB}")
-    return SQLDatabase.from_uri(f"sqlite:///{WORKING_DB}")
 
+class _SessionEnd:
+    """Kept in the session state, finalized once Streamlit drops the session"""
 
-def _calculate_file_checksum(file_path: str) -> str:
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        # Read and update hash string value in blocks of 4K
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
 
+def _release_snapshot_on_session_end(pool: "SnapshotPool") -> None:
+    """
+    Release the snapshot of the session once the session has ended.
+
+    Streamlit has no hook for the end of a session. It keeps disconnected
+    sessions for a while in case the browser reconnects, then drops them
+    with their state, which finalizes the marker kept in it.
+    """
+    if "session_end" not in st.session_state:
+        marker = _SessionEnd()
+        weakref.finalize(marker, pool.release, _session_id())
+        st.session_state["session_end"] = marker
+
+
+def _reset_database() -> None:
+    """Restore the session database to the original database"""
+    load_snapshot_pool().reset(_session_id())
+
+
+def _unique_columns(columns: list[str]) -> list[str]:
+    seen: dict[str, int] = {}
+    unique = []
+    for column in columns:
+        seen[column] = seen.get(column, 0) + 1
+        unique.append(column if seen[column] == 1 else f"{column} ({seen[column]})")
+    return unique
+
+
+def _show_rows(result: "StatementResult") -> None:
+    """
+    Render rows as typed dataframes, split into tabs of RESULT_PAGE_SIZE rows.
+
+    Streamlit sends every tab to the browser, so the tabs only split the
+    display. The rows sent per statement are bounded by the row budget of
+    the executor, QUERY_MAX_ROWS. Rendering a single page at a time would
+    rerun the script of the page, which no longer shows the results then.
+    """
+    import pandas as pd
+
+    if not result.rows:
+        st.caption("No rows returned.")
+        return
+
+    frame = pd.DataFrame(
+        result.rows, columns=_unique_columns(result.columns)
+    ).convert_dtypes()
+    starts = range(0, len(frame), RESULT_PAGE_SIZE)
+    if len(starts) == 1:
+        st.dataframe(frame, use_container_width=True, hide_index=True)
+    else:
+        tabs = st.tabs(
+            [f"Rows {i + 1}-{min(i + RESULT_PAGE_SIZE, len(frame))}" for i in starts]
+        )
+        for tab, i in zip(tabs, starts):
+            with tab:
+                st.dataframe(
+                    frame.iloc[i : i + RESULT_PAGE_SIZE],
+                    use_container_width=True,
+                    hide_index=True,
+                )
+    if result.truncated:
+        st.caption(
+            f"Only the first {len(frame)} rows are shown, the rest were not fetched."
+        )
 
-def has_database_changed() -> bool:
-    """Check if the working database has been changed"""
-    original_checksum = _calculate_file_checksum(BACKUP_DB)
-    current_checksum = _calculate_file_checksum(WORKING_DB)
-    return original_checksum != current_checksum
+
+def show_sql_results(batch: "BatchResult") -> None:
+    for result in batch.results:
+        if result.aborted:
+            st.warning(result.error)
+            continue
+        if result.error is not None:
+            st.error("Failed to execute SQL query!")
+            print(result.error)
+            continue
+
+        st.markdown("### SQL Result:")
+        _show_rows(result)
 
 
 def user_prompt_with_button() -> tuple[str, bool]:
@@ -64,11 +194,124 @@ def user_prompt_with_button() -> tuple[str, bool]:
     return user_request, enter
 
 
-def success_or_try_again(message: str, success: bool) -> None:
+@contextmanager
+def queued_llm_calls() -> Iterator[None]:
+    """Show the queue position of the session while its model calls wait"""
+    from modules.admission import Overloaded, admission_session
+
+    placeholder = st.empty()
+
+    def show_position(position: int) -> None:
+        if position:
+            placeholder.info(
+                f"Many players are playing right now, you are number {position} in the queue ..."
+            )
+        else:
+            placeholder.empty()
+
+    try:
+        with admission_session(_session_id(), show_position):
+            yield
+    except Overloaded as e:
+        print(e)
+        placeholder.empty()
+        st.error("Too many players are playing right now, please try again shortly.")
+        st.stop()
+
+
+@contextmanager
+def cancellable_submission(level: str) -> Iterator[None]:
+    """
+    Cancel the model calls of a submission once the player resubmits or leaves.
+
+    Clicking Enter again or switching pages makes Streamlit request a rerun
+    of the script, closing the tab a stop. Streamlit only carries them out
+    at the next element rendered, so the pending request is polled while the
+    model calls are queued or streaming instead.
+    """
+    from streamlit.runtime.scriptrunner.script_requests import ScriptRequestType
+
+    from modules.cancellation import ABANDONED, SUPERSEDED, Cancelled, submission
+
+    ctx = get_script_run_ctx()
+    reasons = {ScriptRequestType.RERUN: SUPERSEDED, ScriptRequestType.STOP: ABANDONED}
+
+    def pending_request() -> Optional[str]:
+        # Streamlit has no public accessor for the pending request
+        return reasons.get(getattr(ctx.script_requests, "_state", None))
+
+    try:
+        with submission(ctx.session_id, level, pending_request):
+            yield
+    except Cancelled:
+        # Rendering lets Streamlit carry out the pending rerun or stop
+        st.empty()
+        st.stop()
+
+
+def run_level_in_page(
+    level: str,
+    question: str,
+    chain: "Runnable",
+    spinners: dict[str, str],
+    safeguard_llm: Optional["BaseChatModel"] = None,
+    skip_safeguard_for: frozenset["StatementKind"] = frozenset(),
+) -> "BatchResult":
+    """
+    Run the pipeline of the level on the session database, rendering it.
+
+    `spinners` maps stages to the message shown while they run. The model
+    output is streamed into code blocks and the results shown at the end.
+    """
+    from modules.pipeline import LevelHooks, run_level
+    from modules.speculation import speculation_enabled
+    from modules.streaming import stream_code
+
+    @contextmanager
+    def stage(name: str) -> Iterator[None]:
+        if name in STAGE_HEADINGS:
+            st.markdown(STAGE_HEADINGS[name])
+        with ExitStack() as stack:
+            if name in spinners:
+                stack.enter_context(st.spinner(spinners[name]))
+            if name in MODEL_STAGES:
+                stack.enter_context(queued_llm_calls())
+            yield
+
+    def safeguard_skipped(kind: "StatementKind") -> None:
+        st.info(f"The generated SQL is {kind.value}, the LLM Safeguard was skipped.")
+
+    pool = load_snapshot_pool()
+    _release_snapshot_on_session_end(pool)
+    result = run_level(
+        level,
+        question,
+        chain,
+        pool,
+        _session_id(),
+        safeguard_llm=safeguard_llm,
+        classifier=load_sql_classifier(),
+        skip_safeguard_for=skip_safeguard_for,
+        budget=query_budget(),
+        speculate=speculation_enabled(),
+        result_cache=load_result_cache(),
+        hooks=LevelHooks(stage, stream_code, safeguard_skipped),
+    )
+    if result.batch is None:
+        st.error("No SQL query found!")
+        st.stop()
+    show_sql_results(result.batch)
+    return result.batch
+
+
+def success_or_try_again(message: str, success: bool, level: str) -> None:
+    from modules.metrics import span
+
     if success:
         st.balloons()
         st.success(message)
-        _reset_database()
+        with span("reset", level):
+            _reset_database()
         st.stop()
     else:
         st.warning("The database was not altered.")
@@ -0,0 +1,125 @@
+import dataclasses
+import importlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
+import streamlit as st
+from dotenv import load_dotenv
+from streamlit.runtime.scriptrunner import (
+    ScriptRunContext,
+    add_script_run_ctx,
+    get_script_run_ctx,
+)
+
+# Modules imported by the level pages, in import order
+LEVEL_MODULES = [
+    "modules.metrics",
+    "modules.admission",
+    "modules.schema",
+    "modules.llm_cache",
+    "modules.safeguard",
+    "modules.executor",
+    "modules.snapshots",
+]
+# Models of the level pages, built ahead of time
+WARM_UP_MODELS = ["gpt-3.5-turbo", "gpt-4"]
+# Models generating SQL, whose chains are built ahead of time too
+WARM_UP_CHAIN_MODELS = ["gpt-3.5-turbo"]
+
+
+@contextmanager
+def _step(timings: dict[str, float], name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        # A failing step is retried by the page needing it
+        print(f"Warm-up step {name} failed: {e!r}")
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+def warm_up() -> dict[str, float]:
+    """
+    Import the level modules and build the shared resources they use.
+
+    Returns the duration of each step in milliseconds, which is also printed
+    to the logs.
+    """
+    timings: dict[str, float] = {}
+    load_dotenv()
+    with _step(timings, "imports"):
+        for module in LEVEL_MODULES:
+            importlib.import_module(module)
+
+    from modules.llm_cache import enable_llm_cache
+    from modules.models import load_chat_model
+    from modules.schema import (
+        golden_version,
+        load_schema_database,
+        load_sql_query_chain,
+    )
+    from modules.utils import load_snapshot_pool, load_sql_classifier
+
+    with _step(timings, "checksum"):
+        version = golden_version()
+    with _step(timings, "schema"):
+        load_schema_database(version)
+    with _step(timings, "snapshots"):
+        load_snapshot_pool()
+    with _step(timings, "classifier"):
+        load_sql_classifier()
+    with _step(timings, "llm_cache"):
+        enable_llm_cache()
+    with _step(timings, "models"):
+        for model in WARM_UP_MODELS:
+            load_chat_model(model)
+    with _step(timings, "chains"):
+        for model in WARM_UP_CHAIN_MODELS:
+            load_sql_query_chain(load_chat_model(model))
+
+    print(
+        f"Warm-up done in {sum(timings.values()):.0f} ms: "
+        + ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+    )
+    return timings
+
+
+def _detached_ctx(ctx: ScriptRunContext) -> ScriptRunContext:
+    """
+    Copy of a script run context that renders nothing into its page.
+
+    The spinners of the cached resources, and the placeholders they leave
+    even when they are not shown, are dropped instead of being inserted
+    into the page of the visitor at their current position.
+    """
+    return dataclasses.replace(
+        ctx,
+        _enqueue=lambda msg: None,
+        cursors={},
+        tracked_commands=[],
+        tracked_commands_counter=Counter(),
+        script_requests=None,
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up() -> threading.Thread:
+    """
+    Warm up in a background thread, once per process.
+
+    Streamlit only caches resources for threads having a script run context,
+    so the thread gets a detached copy of the one of the first visitor.
+    """
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    add_script_run_ctx(thread, _detached_ctx(get_script_run_ctx()))
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    # Timings of the warm-up steps in a cold process
+    warm_up()
@@ -0,0 +1,72 @@
+import pandas as pd
+import streamlit as st
+
+from modules.metrics import read_spans
+from modules.utils import set_sidebar
+
+PAGE_TITLE = "Admin Metrics"
+
+
+def _percentiles(spans: pd.DataFrame, by: list[str]) -> pd.DataFrame:
+    durations = spans.groupby(by)["duration_ms"]
+    return pd.DataFrame(
+        {
+            "Count": durations.count(),
+            "p50 (ms)": durations.quantile(0.50),
+            "p95 (ms)": durations.quantile(0.95),
+            "p99 (ms)": durations.quantile(0.99),
+            "Tokens": spans.groupby(by)["total_tokens"].sum(),
+            "Cost (USD)": spans.groupby(by)["cost_usd"].sum(),
+        }
+    ).round({"p50 (ms)": 1, "p95 (ms)": 1, "p99 (ms)": 1, "Cost (USD)": 4})
+
+
+def main():
+    st.set_page_config(
+        page_title=PAGE_TITLE,
+        page_icon="assets/effixis_logo.ico",
+        layout="wide",
+    )
+    set_sidebar()
+
+    st.title(PAGE_TITLE)
+    st.markdown(
+        """
+        ### *Latency, tokens and cost of each pipeline stage*
+        Spans are read from the rotating metrics log, so only the most recent ones are kept.
+        """
+    )
+
+    spans = pd.DataFrame(read_spans())
+    if spans.empty:
+        st.info("No metrics recorded yet.")
+        st.stop()
+
+    spans["total_tokens"] = spans["prompt_tokens"] + spans["completion_tokens"]
+    levels = st.multiselect("Levels:", sorted(spans["level"].unique()))
+    if levels:
+        spans = spans[spans["level"].isin(levels)]
+
+    st.markdown("#### Per stage")
+    st.dataframe(_percentiles(spans, ["stage"]), use_container_width=True)
+
+    st.markdown("#### Per level and stage")
+    st.dataframe(_percentiles(spans, ["level", "stage"]), use_container_width=True)
+
+    if "cancelled" in spans:
+        st.markdown("#### Cancelled submissions")
+        st.caption(
+            "Submissions whose model calls were aborted because the player resubmitted or left."
+        )
+        submissions = spans[spans["stage"] == "submission"]
+        outcomes = submissions["cancelled"].fillna("completed").str.capitalize()
+        st.dataframe(
+            pd.crosstab(submissions["level"], outcomes), use_container_width=True
+        )
+
+    st.markdown("#### Latest spans")
+    st.dataframe(spans.tail(100).iloc[::-1], use_container_width=True)
+
+
+if __name__ == "__main__":
+    main()
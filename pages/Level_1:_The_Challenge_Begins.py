@@ -1,14 +1,15 @@
 import os
-from sqlite3 import OperationalError
 
 import streamlit as st
 from dotenv import load_dotenv
-from langchain.chains import create_sql_query_chain
-from langchain_openai import ChatOpenAI
 
+from modules.llm_cache import enable_llm_cache
+from modules.metrics import span
+from modules.models import load_chat_model
+from modules.schema import load_sql_query_chain
 from modules.utils import (
-    has_database_changed,
-    load_database,
+    cancellable_submission,
+    run_level_in_page,
     set_sidebar,
     success_or_try_again,
     user_prompt_with_button,
@@ -16,10 +17,9 @@ from modules.utils import (
 
 load_dotenv()
 
-OPENAI_INSTANCE = ChatOpenAI(
-    model="gpt-3.5-turbo",
-    temperature=0,
-)
+OPENAI_MODEL = "gpt-3.5-turbo"
+# Messages shown while the stages of the level run
+SPINNERS = {"sql_generation": "Generating response ..."}
 PAGE_TITLE = "Level 1: The Challenge Begins"
 
 
@@ -40,39 +40,29 @@ def main():
         """
     )
 
-    database = load_database()
-    chain = create_sql_query_chain(llm=OPENAI_INSTANCE, db=database)
+    enable_llm_cache()
+    llm = load_chat_model(OPENAI_MODEL)
+    with span("chain_construction", PAGE_TITLE):
+        chain = load_sql_query_chain(llm)
 
     with st.expander("About the database"):
         st.image("assets/chinook.png")
 
     user_prompt, enter = user_prompt_with_button()
     if enter and len(user_prompt):
-        with st.spinner("Generating response ..."):
-            openai_response = chain.invoke({"question": user_prompt})
-
-        st.markdown("### Generated SQL:")
-        st.code(openai_response, language="sql")
-
-        success = False
-        for sql_query in openai_response.split(";"):
-            try:
-                sql_result = database.run(sql_query)
-            except OperationalError as e:
-                st.error("Failed to execute SQL query!")
-                print(e)
-                continue
-
-            st.markdown("### SQL Result:")
-            st.text(sql_result)
-            if has_database_changed():
-                success = True
-                break
-
-        success_or_try_again(
-            message=f"Congratulations! You have successfully altered the database and passed Level 1! Here's your key: `{os.environ.get('LEVEL_1_KEY')}`",
-            success=success,
-        )
+        with cancellable_submission(PAGE_TITLE):
+            batch = run_level_in_page(
+                PAGE_TITLE,
+                user_prompt,
+                chain,
+                SPINNERS,
+            )
+
+            success_or_try_again(
+                message=f"Congratulations! You have successfully altered the database and passed Level 1! Here's your key: `{os.environ.get('LEVEL_1_KEY')}`",
+                success=batch.modified,
+                level=PAGE_TITLE,
+            )
 
 
 if __name__ == "__main__":
@@ -1,28 +1,55 @@
+import math
 import os
 
-import pandas as pd
-import requests
 import streamlit as st
 from dotenv import load_dotenv
 
+from modules.leaderboard import (
+    CachedLeaderboard,
+    DisplayNameTaken,
+    InMemoryBackend,
+    LeaderboardError,
+    PantryBackend,
+    SQLiteBackend,
+)
+from modules.models import load_http_client
+from modules.sqlite_profile import sqlite_profile
 from modules.utils import set_sidebar
+from modules.warmup import start_warm_up
 
 load_dotenv()
 
 PANTRY_ID = os.environ.get("PANTRY_ID")
 PANTRY_BASKET = os.environ.get("PANTRY_BASKET")
-assert (
-    PANTRY_ID is not None and PANTRY_BASKET is not None
-), "Pantry ID and basket name must be set in .env file."
+LEADERBOARD_BACKEND = os.environ.get("LEADERBOARD_BACKEND", "pantry")
+LEADERBOARD_DB = os.environ.get("LEADERBOARD_DB", "data/leaderboard.db")
+LEADERBOARD_SYNC_SECONDS = float(os.environ.get("LEADERBOARD_SYNC_SECONDS", 30.0))
 
 
 PAGE_TITLE = "The Leaderboard"
-
-pd.set_option("future.no_silent_downcasting", True)
-
-
-def _user_passed_level(df: pd.DataFrame, name: str, level: str) -> bool:
-    return df.loc[df["Name"] == name, level].values[0] == "✅"
+LEADERBOARD_PAGE_SIZE = 50
+
+
+@st.cache_resource(show_spinner=False)
+def load_leaderboard() -> CachedLeaderboard:
+    if LEADERBOARD_BACKEND == "memory":
+        backend = InMemoryBackend()
+    elif LEADERBOARD_BACKEND == "sqlite":
+        # Optionally mirror the local leaderboard to Pantry in batches
+        sync_to = None
+        if PANTRY_ID is not None and PANTRY_BASKET is not None:
+            sync_to = PantryBackend(PANTRY_ID, PANTRY_BASKET, client=load_http_client())
+        backend = SQLiteBackend(
+            LEADERBOARD_DB,
+            sync_to=sync_to,
+            sync_interval=LEADERBOARD_SYNC_SECONDS,
+            profile=sqlite_profile(),
+        )
+    else:
+        backend = PantryBackend(PANTRY_ID, PANTRY_BASKET, client=load_http_client())
+    return CachedLeaderboard(
+        backend, ttl=float(os.environ.get("LEADERBOARD_TTL_SECONDS", 5.0))
+    )
 
 
 def main():
@@ -32,6 +59,7 @@ def main():
         layout="centered",
     )
     set_sidebar()
+    start_warm_up()
 
     st.title(PAGE_TITLE)
 
@@ -42,43 +70,30 @@ def main():
         """
     )
 
+    # Checked here rather than on import, so the rest of the app starts without it
+    if LEADERBOARD_BACKEND == "pantry" and (PANTRY_ID is None or PANTRY_BASKET is None):
+        st.error("Pantry ID and basket name must be set in .env file.")
+        st.stop()
+
     # Display leaderboard
-    leaderboard_url = (
-        f"https://getpantry.cloud/apiv1/pantry/{PANTRY_ID}/basket/{PANTRY_BASKET}"
-    )
-    leaderboard_response = requests.get(leaderboard_url)
-    if leaderboard_response.status_code == 200:
-        leaderboard_json = leaderboard_response.json()
-        print(f"Leaderboard data: {leaderboard_json}")
-        leaderboard_data = (
-            pd.DataFrame(leaderboard_json)
-            .transpose()
-            .rename(
-                columns={
-                    "level 0": "Level 1",
-                    "level 1": "Level 2",
-                    "level 2": "Level 3",
-                },
-            )[["Level 1", "Level 2", "Level 3"]]
-            .fillna(False)
-            .map(lambda x: "✅" if x else "❌")
-            .assign(
-                # Weighted sum of the levels
-                Score=lambda df: df.apply(
-                    lambda x: sum(
-                        [int(passing == "✅") * (i + 1) for i, passing in enumerate(x)]
-                    ),
-                    axis=1,
-                )
-            )
-            .sort_values(by="Score", ascending=False)
-            .reset_index()
-            .rename(columns={"index": "Name"})
-        )
-        st.dataframe(leaderboard_data)
-    else:
+    leaderboard = load_leaderboard()
+    try:
+        ranking = leaderboard.get()
+    except LeaderboardError as e:
+        print(e)
         st.error("An error occurred while fetching the leaderboard.")
         st.stop()
+    else:
+        if len(ranking) == 0:
+            st.info("Nobody is on the leaderboard yet, be the first!")
+        else:
+            pages = math.ceil(len(ranking) / LEADERBOARD_PAGE_SIZE)
+            page = st.number_input("Page", min_value=1, max_value=pages, value=1)
+            st.dataframe(
+                ranking.page(page - 1, LEADERBOARD_PAGE_SIZE),
+                use_container_width=True,
+            )
+            st.caption(f"{len(ranking)} players, page {page} of {pages}.")
 
     # Submit keys
     with st.form("leaderboard"):
@@ -91,66 +106,27 @@ def main():
         submit = st.form_submit_button("Submit")
 
         if submit and key and email and display_name:
-            if (
-                display_name in leaderboard_json.keys()
-                and email != leaderboard_json[display_name]["email"]
-            ):
+            level_keys = [
+                os.environ.get("LEVEL_1_KEY"),
+                os.environ.get("LEVEL_2_KEY"),
+                os.environ.get("LEVEL_3_KEY"),
+            ]
+            if key not in level_keys:
+                st.error("Invalid key!")
+                st.stop()
+
+            try:
+                leaderboard.submit(display_name, email, level=level_keys.index(key))
+
+                st.success(
+                    "You should soon be able to see your name and your scores on the leaderboard! 🎉"
+                )
+            except DisplayNameTaken:
                 st.error(
                     "This display name is already taken, please choose another one."
                 )
-            else:
-                if key not in {
-                    os.environ.get("LEVEL_1_KEY"),
-                    os.environ.get("LEVEL_2_KEY"),
-                    os.environ.get("LEVEL_3_KEY"),
-                }:
-                    st.error("Invalid key!")
-                    st.stop()
-
-                if display_name not in leaderboard_json.keys():
-                    data = {
-                        display_name: {
-                            "email": email,
-                            "level 0": key == os.environ.get("LEVEL_1_KEY"),
-                            "level 1": key == os.environ.get("LEVEL_2_KEY"),
-                            "level 2": key == os.environ.get("LEVEL_3_KEY"),
-                        }
-                    }
-                else:
-                    data = {
-                        display_name: {
-                            "email": email,
-                            "level 0": (
-                                key == os.environ.get("LEVEL_1_KEY")
-                                or _user_passed_level(
-                                    leaderboard_data, display_name, "Level 1"
-                                )
-                            ),
-                            "level 1": (
-                                key == os.environ.get("LEVEL_2_KEY")
-                                or _user_passed_level(
-                                    leaderboard_data, display_name, "Level 2"
-                                )
-                            ),
-                            "level 2": (
-                                key == os.environ.get("LEVEL_3_KEY")
-                                or _user_passed_level(
-                                    leaderboard_data, display_name, "Level 3"
-                                )
-                            ),
-                        }
-                    }
-
-                try:
-                    updated_data = leaderboard_json | data
-                    print(f"Updated data: {updated_data}")
-                    _ = requests.post(leaderboard_url, json=leaderboard_json | data)
-
-                    st.success(
-                        "You should soon be able to see your name and your scores on the leaderboard! 🎉"
-                    )
-                except Exception as e:
-                    st.error(f"An error occurred while submitting your key: {e}")
+            except Exception as e:
+                st.error(f"An error occurred while submitting your key: {e}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import openai
+import pytest
+
+# Must be set before the app modules are imported
+os.environ.setdefault(
+    "METRICS_PATH",
+    os.path.join(tempfile.mkdtemp(prefix="tests_"), "metrics.jsonl"),
+)
+# The model calls of the tests are not rate limited
+os.environ.setdefault("LLM_LIMITS", "gpt-3.5-turbo=1000000:1000000000")
+
+from benchmarks.openai_stub import StubServer, start_stub  # noqa: E402
+from modules.admission import AdmittedChatOpenAI  # noqa: E402
+from modules.models import load_http_client  # noqa: E402
+from modules.snapshots import SnapshotPool  # noqa: E402
+from modules.sql_classifier import SQLClassifier  # noqa: E402
+
+GOLDEN_DB = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data",
+    "chinook_backup.db",
+)
+
+
+@pytest.fixture(scope="session")
+def classifier() -> SQLClassifier:
+    return SQLClassifier(GOLDEN_DB)
+
+
+@pytest.fixture
+def pool() -> SnapshotPool:
+    return SnapshotPool(GOLDEN_DB, spares=1)
+
+
+@pytest.fixture(scope="session")
+def stub() -> StubServer:
+    server = start_stub(first_token_ms=0, token_ms=0)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def model(stub) -> AdmittedChatOpenAI:
+    """Model on a pool configured like the shared one, but of its own"""
+    http_client = load_http_client.__wrapped__()
+    client = openai.OpenAI(base_url=stub.url, api_key="stub", http_client=http_client)
+    yield AdmittedChatOpenAI(
+        model="gpt-3.5-turbo",
+        streaming=True,
+        cache=False,
+        openai_api_key="stub",
+        client=client.chat.completions,
+    )
+    http_client.close()
@@ -0,0 +1,139 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.openai_stub import DEFAULT_SQL
+from modules.admission import (
+    AdmissionController,
+    ModelLimits,
+    Overloaded,
+    TokenBucket,
+)
+from modules.safeguard import _generate_safeguard, extract_safe_query
+from modules.streaming import StopStream, collect_stream, has_closed_sql_block
+
+MODEL = "model"
+
+
+def drained(limits: ModelLimits, **kwargs) -> AdmissionController:
+    """Controller whose request bucket was just emptied by a burst of calls"""
+    controller = AdmissionController({MODEL: limits}, **kwargs)
+    for _ in range(int(TokenBucket(limits.requests_per_minute).capacity)):
+        controller.acquire(MODEL, "burst", 1)
+    return controller
+
+
+def wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_sessions_are_served_round_robin():
+    controller = drained(ModelLimits(1200, 10**9))
+    admitted = []
+    positions = {}
+    lock = threading.Lock()
+
+    def call(session_id: str, name: str) -> None:
+        def on_position(position: int) -> None:
+            positions.setdefault(name, position)
+
+        controller.acquire(MODEL, session_id, 1, on_position)
+        with lock:
+            admitted.append(name)
+
+    threads = []
+    for session_id, name in [("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")]:
+        waiting = controller.waiting
+        threads.append(threading.Thread(target=call, args=(session_id, name)))
+        threads[-1].start()
+        wait_for(lambda: controller.waiting > waiting)
+    for thread in threads:
+        thread.join()
+
+    # A later session is not stuck behind all the calls of an earlier one
+    assert admitted == ["a1", "b1", "a2", "a3"]
+    assert positions["a1"] == 1
+    assert controller.waiting == 0
+
+
+def test_calls_beyond_max_queue_are_shed():
+    controller = drained(ModelLimits(600, 10**9), max_queue=1)
+    waiting = threading.Thread(target=controller.acquire, args=(MODEL, "a", 1))
+    waiting.start()
+    wait_for(lambda: controller.waiting == 1)
+
+    with pytest.raises(Overloaded):
+        controller.acquire(MODEL, "b", 1)
+    assert controller.shed == 1
+    waiting.join()
+
+
+def test_calls_waiting_longer_than_max_wait_are_shed():
+    controller = drained(ModelLimits(6, 10**9), max_wait=0.1)
+    with pytest.raises(Overloaded):
+        controller.acquire(MODEL, "a", 1)
+    assert controller.shed == 1
+    assert controller.waiting == 0
+
+
+def test_cancelled_calls_leave_the_queue():
+    controller = drained(ModelLimits(6, 10**9))
+    cancel = threading.Event()
+
+    def check() -> None:
+        if cancel.is_set():
+            raise RuntimeError("cancelled")
+
+    errors = []
+
+    def call() -> None:
+        try:
+            controller.acquire(MODEL, "a", 1, check=check)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    wait_for(lambda: controller.waiting == 1)
+    cancel.set()
+    thread.join(timeout=5.0)
+
+    assert len(errors) == 1
+    assert controller.waiting == 0
+    assert controller.cancelled == 1
+
+
+def test_unused_tokens_are_given_back():
+    controller = AdmissionController({MODEL: ModelLimits(10**6, 600)})
+    # The bucket holds 6 seconds of tokens per minute
+    controller.acquire(MODEL, "a", 60)
+    controller.settle(MODEL, reserved=60, used=10)
+    start = time.monotonic()
+    controller.acquire(MODEL, "b", 50)
+    assert time.monotonic() - start < 0.5
+
+
+def test_admitted_model_streams_tokens_to_the_callbacks(model):
+    handler = StopStream()
+    text = collect_stream(
+        lambda callbacks: model.invoke(
+            "Rename the first artist", config={"callbacks": callbacks}
+        ).content,
+        handler=handler,
+    )
+    assert text.strip() == DEFAULT_SQL
+    # The tokens reached the callbacks while streaming
+    assert handler.text == text
+
+
+def test_admitted_model_stream_stops_early(model):
+    text = collect_stream(
+        _generate_safeguard(model, DEFAULT_SQL), stop_after=has_closed_sql_block
+    )
+    assert extract_safe_query(text).strip() == DEFAULT_SQL
+    # The text following the SQL block was not waited for
+    assert "executed safely" not in text
@@ -0,0 +1,130 @@
+import pytest
+
+from modules.executor import QueryBudget, execute_batch
+from modules.result_cache import ResultCache
+
+ARTIST_1 = "SELECT Name FROM Artist WHERE ArtistId = 1"
+
+
+@pytest.fixture
+def cache(classifier) -> ResultCache:
+    return ResultCache(classifier, lambda: "golden")
+
+
+@pytest.mark.parametrize(
+    "statement, modified",
+    [
+        ("SELECT 1", False),
+        ("UPDATE Artist SET Name = 'x' WHERE 0", False),
+        ("DELETE FROM Artist WHERE ArtistId = -1", False),
+        ("CREATE TABLE IF NOT EXISTS Artist (x)", False),
+        ("DROP TABLE IF EXISTS Nope", False),
+        ("CREATE INDEX IF NOT EXISTS IFK_AlbumArtistId ON Album (ArtistId)", False),
+        ("PRAGMA user_version = 0", False),
+        ("PRAGMA case_sensitive_like = 1", False),
+        ("DELETE FROM Artist WHERE ArtistId = 1", True),
+        ("CREATE TABLE New (x)", True),
+        ("DROP TABLE PlaylistTrack", True),
+        ("PRAGMA user_version = 7", True),
+    ],
+)
+def test_modified_only_when_the_database_changed(pool, statement, modified):
+    snapshot = pool.acquire("session")
+    assert execute_batch(snapshot, [statement]).modified is modified
+    # Every batch is rolled back
+    assert execute_batch(snapshot, ["SELECT 1"]).modified is False
+
+
+def test_batch_is_rolled_back(pool):
+    snapshot = pool.acquire("session")
+    batch = execute_batch(snapshot, ["DELETE FROM Artist WHERE ArtistId = 1", ARTIST_1])
+    assert batch.results[1].rows == []
+    assert execute_batch(snapshot, [ARTIST_1]).results[0].rows == [("AC/DC",)]
+
+
+def test_snapshot_is_dirty_once_a_statement_ended_the_transaction(pool):
+    snapshot = pool.acquire("session")
+    batch = execute_batch(snapshot, ["DROP TABLE Artist", "COMMIT", "BEGIN"])
+    assert batch.modified
+    assert snapshot.dirty
+
+    pool.reset("session")
+    count = execute_batch(snapshot, ["SELECT count(*) FROM Artist"]).results[0]
+    assert count.rows == [(275,)]
+
+
+def test_reset_restores_a_copy_after_a_modification(pool):
+    snapshot = pool.acquire("session")
+    execute_batch(snapshot, ["DELETE FROM Artist WHERE ArtistId = 1"])
+    connection = snapshot.connection
+    pool.reset("session")
+    assert snapshot.connection is not connection
+
+    # Attempts that modified nothing keep their copy
+    execute_batch(snapshot, ["SELECT 1"])
+    connection = snapshot.connection
+    pool.reset("session")
+    assert snapshot.connection is connection
+
+
+def test_budget_aborts_long_statements(pool):
+    batch = execute_batch(
+        pool.acquire("session"),
+        [
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)"
+            " SELECT count(*) FROM n",
+            "SELECT 1",
+        ],
+        QueryBudget(max_vm_steps=100_000),
+    )
+    assert batch.results[0].aborted
+    assert batch.results[1].rows == [(1,)]
+
+
+def test_result_cache_answers_read_only_statements(pool, cache):
+    execute_batch(pool.acquire("first"), [ARTIST_1], cache=cache)
+    batch = execute_batch(pool.acquire("second"), [ARTIST_1], cache=cache)
+    assert batch.results[0].cached
+    assert batch.results[0].rows == [("AC/DC",)]
+
+
+def test_result_cache_is_bypassed_after_a_write(pool, cache):
+    execute_batch(pool.acquire("first"), [ARTIST_1], cache=cache)
+    batch = execute_batch(
+        pool.acquire("second"),
+        ["UPDATE Artist SET Name = 'Changed' WHERE ArtistId = 1", ARTIST_1],
+        cache=cache,
+    )
+    assert not batch.results[1].cached
+    assert batch.results[1].rows == [("Changed",)]
+
+
+@pytest.mark.parametrize(
+    "statement",
+    ["PRAGMA case_sensitive_like = 1", "COMMIT", "ATTACH ':memory:' AS other"],
+)
+def test_result_cache_is_bypassed_until_reset_after_lasting_changes(
+    pool, cache, statement
+):
+    execute_batch(pool.acquire("first"), [ARTIST_1], cache=cache)
+    snapshot = pool.acquire("second")
+    execute_batch(snapshot, [statement], cache=cache)
+    assert snapshot.dirty
+    assert not execute_batch(snapshot, [ARTIST_1], cache=cache).results[0].cached
+
+    pool.reset("second")
+    snapshot = pool.acquire("second")
+    assert not snapshot.dirty
+    assert execute_batch(snapshot, [ARTIST_1], cache=cache).results[0].cached
+    # The connection settings are back to the ones of the golden database
+    like, databases = execute_batch(
+        snapshot, ["SELECT 'a' LIKE 'A'", "PRAGMA database_list"]
+    ).results
+    assert like.rows == [(1,)]
+    assert [name for _, name, _ in databases.rows] == ["main"]
+
+
+def test_nondeterministic_statements_are_not_cached(pool, cache):
+    snapshot = pool.acquire("session")
+    execute_batch(snapshot, ["SELECT random()"], cache=cache)
+    assert len(cache) == 0
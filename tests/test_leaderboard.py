@@ -0,0 +1,118 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+from modules.leaderboard import (
+    CachedLeaderboard,
+    DisplayNameTaken,
+    InMemoryBackend,
+    RankingIndex,
+    SQLiteBackend,
+    score_levels,
+)
+
+LEADERBOARD = {
+    "ada": {"email": "ada@example.com", "level 0": True, "level 1": True},
+    "bob": {"email": "bob@example.com", "level 0": True},
+    "cy": {"email": "cy@example.com"},
+}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryBackend()
+    return SQLiteBackend(str(tmp_path / "leaderboard.db"))
+
+
+def test_fetch_is_conditional(backend):
+    backend.submit("ada", "ada@example.com", 0)
+    leaderboard, etag = backend.fetch(None)
+    assert leaderboard["ada"]["level 0"] is True
+    assert backend.fetch(etag) == (None, etag)
+
+    backend.submit("ada", "ada@example.com", 2)
+    leaderboard, new_etag = backend.fetch(etag)
+    assert new_etag != etag
+    assert leaderboard["ada"] == {
+        "email": "ada@example.com",
+        "level 0": True,
+        "level 1": False,
+        "level 2": True,
+    }
+
+
+def test_display_names_belong_to_their_first_email(backend):
+    backend.submit("ada", "ada@example.com", 0)
+    with pytest.raises(DisplayNameTaken):
+        backend.submit("ada", "mallory@example.com", 1)
+    leaderboard, _ = backend.fetch(None)
+    assert leaderboard["ada"]["level 1"] is False
+
+
+def test_in_memory_backend_returns_copies():
+    backend = InMemoryBackend(LEADERBOARD)
+    leaderboard, _ = backend.fetch(None)
+    leaderboard["ada"]["level 2"] = True
+    assert "level 2" not in backend.fetch(None)[0]["ada"]
+
+
+def test_score_weights_levels_by_difficulty():
+    passed = np.array([[True, True, False], [False, False, True], [False] * 3])
+    assert score_levels(passed).tolist() == [3, 3, 0]
+
+
+def test_ranking_index_orders_by_score_then_name():
+    ranking = RankingIndex()
+    ranking.update(LEADERBOARD)
+    assert ranking.page(0, 10)["Name"].tolist() == ["ada", "bob", "cy"]
+    assert ranking.page(0, 10)["Score"].tolist() == [3, 1, 0]
+
+    # Only the changed players are re-ranked
+    ranking.update(LEADERBOARD | {"cy": {"email": "cy@example.com", "level 2": True}})
+    assert ranking.page(0, 2)["Name"].tolist() == ["ada", "cy"]
+    assert ranking.page(1, 2)["Name"].tolist() == ["bob"]
+    assert ranking.lookup("cy") == (False, False, True)
+    assert ranking.lookup("nobody") is None
+
+    ranking.update({"bob": LEADERBOARD["bob"]})
+    assert len(ranking) == 1
+
+
+def test_cached_leaderboard_fetches_once_per_ttl():
+    backend = InMemoryBackend(LEADERBOARD)
+    cached = CachedLeaderboard(backend, ttl=60.0)
+    for _ in range(10):
+        assert len(cached.get()) == 3
+    assert backend.fetches == 1
+
+
+def test_cached_leaderboard_revalidates_in_the_background():
+    backend = InMemoryBackend(LEADERBOARD)
+    cached = CachedLeaderboard(backend, ttl=60.0)
+    cached.get()
+    cached.submit("dee", "dee@example.com", 0)
+
+    # The stale copy is served while it is revalidated
+    assert cached.get().lookup("dee") is None
+    deadline = time.monotonic() + 5.0
+    while cached.get().lookup("dee") is None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert backend.fetches == 2
+
+
+def test_sqlite_backend_closes_its_connections(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "leaderboard.db"))
+    with pytest.raises(RuntimeError):
+        with backend._connect() as connection:
+            connection.execute(
+                "INSERT INTO leaderboard (display_name, email, updated_at)"
+                " VALUES ('ada', 'ada@example.com', 0)"
+            )
+            raise RuntimeError("rolled back")
+    with pytest.raises(sqlite3.ProgrammingError):
+        connection.execute("SELECT 1")
+    assert backend.fetch(None)[0] == {}
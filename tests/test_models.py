@@ -0,0 +1,35 @@
+import time
+
+from benchmarks.openai_stub import DEFAULT_SQL
+from modules.safeguard import _generate_safeguard
+from modules.streaming import collect_stream, has_closed_sql_block
+
+
+def wait_for_closed_connections(stub) -> None:
+    deadline = time.monotonic() + 2.0
+    while stub.open_connections and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_completed_streams_reuse_one_connection(stub, model):
+    wait_for_closed_connections(stub)
+    connections = stub.connections
+    for _ in range(20):
+        collect_stream(
+            lambda callbacks: model.invoke(
+                "List the artists", config={"callbacks": callbacks}
+            ).content
+        )
+    assert stub.connections - connections == 1
+
+
+def test_streams_stopped_early_close_their_connection(stub, model):
+    wait_for_closed_connections(stub)
+    for _ in range(20):
+        collect_stream(
+            _generate_safeguard(model, DEFAULT_SQL), stop_after=has_closed_sql_block
+        )
+    # Their unread rest makes them unusable for the next call, so none of
+    # them may be left open in the pool
+    wait_for_closed_connections(stub)
+    assert stub.open_connections == 0
@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from modules.executor import execute_batch
+
+
+def test_leased_snapshots_are_not_evicted(pool):
+    pool.max_sessions = 2
+    with pool.lease("a") as snapshot:
+        pool.acquire("b")
+        pool.acquire("c")
+        assert execute_batch(snapshot, ["SELECT 1"]).results[0].rows == [(1,)]
+
+    # Once returned, the snapshot is evicted like any other
+    pool.acquire("d")
+    assert pool.session_count == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        snapshot.connection.execute("SELECT 1")
+
+
+def test_snapshots_released_while_leased_are_closed_when_returned(pool):
+    with pool.lease("a") as snapshot:
+        pool.release("a")
+        assert execute_batch(snapshot, ["SELECT 1"]).results[0].rows == [(1,)]
+
+    assert pool.session_count == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        snapshot.connection.execute("SELECT 1")
+
+
+def test_leases_of_a_session_share_its_snapshot(pool):
+    with pool.lease("a") as first, pool.lease("a") as second:
+        assert first is second
+        assert first.leases == 2
+    assert first.leases == 0
@@ -0,0 +1,36 @@
+from concurrent.futures import wait
+
+import pytest
+
+from modules.executor import execute_batch
+from modules.speculation import SpeculativeExecution
+
+
+@pytest.fixture
+def escaping(tmp_path) -> list[str]:
+    """Statements writing files if they ran outside of the executor's transaction"""
+    return [
+        f"ATTACH DATABASE '{tmp_path / 'attached.db'}' AS attached",
+        "CREATE TABLE attached.t (a)",
+        "INSERT INTO attached.t VALUES (42)",
+        "COMMIT",
+        f"VACUUM INTO '{tmp_path / 'copy.db'}'",
+    ]
+
+
+def test_borrowed_snapshots_are_sandboxed(pool, tmp_path, escaping):
+    snapshot = pool.borrow()
+    batch = execute_batch(snapshot, escaping)
+    snapshot.close()
+
+    assert all(result.error is not None for result in batch.results)
+    assert snapshot.tracker.denied
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_discarded_speculation_leaves_no_file_behind(pool, tmp_path, escaping):
+    speculation = SpeculativeExecution(pool, escaping)
+    assert speculation.result_for(["SELECT 1"]) is None
+    # A speculation already running when discarded runs to its end
+    wait([speculation._future])
+    assert list(tmp_path.iterdir()) == []
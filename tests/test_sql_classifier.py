@@ -0,0 +1,67 @@
+import pytest
+
+from modules.sql_classifier import StatementKind, normalize_sql, split_statements
+
+
+@pytest.mark.parametrize(
+    "sql, statements",
+    [
+        ("SELECT 1; SELECT 2", ["SELECT 1;", "SELECT 2;"]),
+        ("SELECT 'a;b' AS text;", ["SELECT 'a;b' AS text;"]),
+        ("SELECT 1 -- ; DROP TABLE Artist", ["SELECT 1 -- ; DROP TABLE Artist"]),
+        ("SELECT 1 /* ; */;", ["SELECT 1 /* ; */;"]),
+        ("SELECT 1;; -- done", ["SELECT 1;"]),
+    ],
+)
+def test_split_statements_ignores_semicolons_in_literals_and_comments(sql, statements):
+    assert split_statements(sql) == statements
+
+
+def test_normalize_sql_keeps_literals():
+    assert (
+        normalize_sql("SELECT  'a  -- b'\n FROM Artist -- comment\n;")
+        == "SELECT 'a  -- b' FROM Artist"
+    )
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT Name FROM Artist LIMIT 5",
+        "WITH first AS (SELECT 1 AS x) SELECT x FROM first",
+        "SELECT 'a;DROP TABLE Artist' AS text",
+        "SELECT 'x'';' || Name FROM Artist -- ; DELETE FROM Artist",
+        "SELECT name, type FROM pragma_table_info('Artist')",
+    ],
+)
+def test_read_only(classifier, sql):
+    assert classifier.classify(sql) == StatementKind.READ_ONLY
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "DELETE FROM Artist",
+        "WITH doomed AS (SELECT ArtistId FROM Artist LIMIT 1)"
+        " DELETE FROM Artist WHERE ArtistId IN (SELECT ArtistId FROM doomed)",
+        "SELECT 1; DROP TABLE Artist",
+        "ATTACH DATABASE ':memory:' AS other",
+        "REPLACE INTO Genre VALUES (1, 'Rock')",
+    ],
+)
+def test_mutating(classifier, sql):
+    assert classifier.classify(sql) == StatementKind.MUTATING
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "PRAGMA table_info(Artist)",
+        "PRAGMA case_sensitive_like = 1",
+        "SELECT * FROM Nope",
+        "SELECT 1; PRAGMA user_version = 3",
+        "WITH x AS (SELECT 1) UPDATE sqlite_master SET sql = NULL",
+    ],
+)
+def test_ambiguous(classifier, sql):
+    assert classifier.classify(sql) == StatementKind.AMBIGUOUS